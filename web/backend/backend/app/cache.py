@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+def result_key(kind, params, geometry_hash):
+    """
+    Returns a content address for a result computed from the given
+    parameters and room geometry
+    """
+    normalized = json.dumps({'kind': kind, 'params': params,
+                             'geometry': geometry_hash},
+                            sort_keys=True, separators=(',', ':'))
+
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+class ResultCache:
+    """
+    Least recently used cache of computed results. Results are kept in
+    memory up to max_bytes, and when a directory is given they are also
+    written to disk, which is trimmed to max_disk_bytes.
+    """
+    def __init__(self, max_bytes, directory=None, max_disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """
+        Returns (content, meta) for key, or None if it is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = self._read(key)
+        if entry is not None:
+            self._remember(key, *entry)
+
+        return entry
+
+    def put(self, key, content, meta=None):
+        meta = meta or {}
+        self._remember(key, content, meta)
+        self._write(key, content, meta)
+
+    def _remember(self, key, content, meta):
+        if len(content) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[0])
+
+            self._entries[key] = (content, meta)
+            self._size += len(content)
+
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, f'{key}.{extension}')
+
+    def _read(self, key):
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(key, 'bin'), 'rb') as f:
+                content = f.read()
+            with open(self._path(key, 'json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Mark as recently used for disk eviction
+        os.utime(self._path(key, 'bin'))
+
+        return content, meta
+
+    def _write(self, key, content, meta):
+        if self.directory is None or len(content) > self.max_disk_bytes:
+            return
+
+        # Write the metadata last, entries without it are never read
+        for extension, data in (('bin', content),
+                                ('json', json.dumps(meta).encode())):
+            path = self._path(key, extension)
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        self._trim_disk()
+
+    def _trim_disk(self):
+        entries = []
+        total = 0
+
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.bin'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+                total += stat.st_size
+
+        for _, key, size in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+
+            for extension in ('json', 'bin'):
+                try:
+                    os.remove(self._path(key, extension))
+                except OSError:
+                    pass
+
+            total -= size
@@ -0,0 +1,214 @@
+import asyncio
+import base64
+import contextvars
+import functools
+import json
+import multiprocessing
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import metrics
+from .export import plan_to_data
+from .map_gen import (plan_building, plan_router_coverage,
+                      render_router_coverage)
+from .viz import figure_to_png
+
+# Seconds between checks for progress of a task called in a worker process
+PROGRESS_INTERVAL = 0.1
+
+class Overloaded(Exception):
+    """
+    Raised when a ComputePool has too much work queued to accept more
+    """
+    def __init__(self, retry_after):
+        super().__init__(f'Compute pool is full, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+class ComputePool:
+    """
+    Runs CPU heavy work away from the event loop. At most max_workers tasks
+    run at once and max_queued more may wait for a worker, further tasks
+    are refused with Overloaded. Tasks run in worker processes, except work
+    on state of this process, which runs in threads.
+    """
+    def __init__(self, max_workers, max_queued, retry_after):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+
+        self._processes = None
+        self._threads = None
+        self._manager = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    async def run(self, func, *args):
+        """
+        Runs func(*args) in a worker process and returns its result. Stages
+        timed in the worker are added to the current trace.
+        """
+        with self.admitted():
+            executor = self._process_pool()
+            try:
+                value, trace = await asyncio.wrap_future(
+                        executor.submit(_traced_call, func, args))
+            except BrokenProcessPool:
+                self._discard(executor)
+                raise
+
+        metrics.merge(trace)
+        return value
+
+    def call(self, func, *args, progress=None):
+        """
+        Blocking counterpart of run for threads outside the event loop, such
+        as background jobs. It takes no place of its own, the caller holds
+        one from admitted() for as long as it needs. When progress is given,
+        it is passed on to func and its calls are forwarded from the worker.
+        """
+        reports = None
+        if progress is not None:
+            with self._lock:
+                if self._manager is None:
+                    self._manager = multiprocessing.Manager()
+                reports = self._manager.Queue()
+
+        executor = self._process_pool()
+        future = executor.submit(_traced_call, func, args, reports)
+        while reports is not None:
+            try:
+                progress(*reports.get(timeout=PROGRESS_INTERVAL))
+            except queue.Empty:
+                if future.done():
+                    break
+
+        try:
+            value, trace = future.result()
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+        metrics.merge(trace)
+        return value
+
+    async def run_thread(self, func, *args):
+        """
+        Runs func(*args) in a worker thread and returns its result
+        """
+        with self.admitted():
+            with self._lock:
+                if self._threads is None:
+                    self._threads = ThreadPoolExecutor(self.max_workers)
+                executor = self._threads
+
+            # Run in a copy of this context so the current trace is kept
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                    executor, functools.partial(context.run, func, *args))
+
+    @contextmanager
+    def admitted(self):
+        """
+        Holds a place among the pending tasks, raises Overloaded when the
+        pool is full
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queued:
+                raise Overloaded(self.retry_after)
+
+            self._pending += 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _process_pool(self):
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(self.max_workers)
+            return self._processes
+
+    def _discard(self, executor):
+        # Start over with new workers on the next task
+        with self._lock:
+            if self._processes is executor:
+                self._processes = None
+
+def _traced_call(func, args, reports=None):
+    kwargs = {}
+    if reports is not None:
+        kwargs['progress'] = lambda stage, percent: reports.put((stage,
+                                                                 percent))
+
+    with metrics.tracing() as trace:
+        value = func(*args, **kwargs)
+
+    return value, trace
+
+def plan_coverage(rooms, params, workers, session=None, progress=None):
+    """
+    Runs the solve pipeline with the parameters of a request, reusing the
+    previous solve of a map session when one is given
+    """
+    if session is None:
+        return plan_router_coverage(rooms, params['gres'], params['maxloss'],
+                                    params['mode'], params['timelimit'],
+                                    params['gap'], workers, progress,
+                                    params['coarse'], params['tile'],
+                                    params['candidates'], params['spacing'])
+
+    with session.lock:
+        return session.update(rooms, params['mode'], params['timelimit'],
+                              params['gap'], workers, progress,
+                              params['coarse'])
+
+def solve_image(rooms, params, workers, session=None, progress=None):
+    """
+    Returns the PNG of the coverage map and the CoverResult
+    """
+    plan = plan_coverage(rooms, params, workers, session, progress)
+    fig = render_router_coverage(plan)
+
+    with metrics.stage('png'):
+        png = figure_to_png(fig)
+
+    return png, plan.cover
+
+def solve_data(rooms, params, workers, session=None):
+    """
+    Returns the JSON coverage data and the CoverResult
+    """
+    plan = plan_coverage(rooms, params, workers, session)
+    data = plan_to_data(plan, rooms, params['dtype'], params['compress'])
+
+    return json.dumps(data).encode(), plan.cover
+
+def solve_building(floors, params, workers):
+    """
+    Returns the JSON coverage data and image of every floor
+    """
+    # Floors solved in worker processes are only timed as a whole
+    with metrics.stage('floors'):
+        results = plan_building(floors, params['gres'], params['maxloss'],
+                                params['mode'], params['timelimit'],
+                                params['gap'], workers, params['coarse'],
+                                params['tile'], params['candidates'],
+                                params['spacing'])
+
+    data = {'floors': []}
+    for z, (plan, png) in results.items():
+        floor = plan_to_data(plan, floors[z])
+        floor['z'] = z
+        floor['image'] = base64.b64encode(png).decode('ascii')
+        data['floors'].append(floor)
+
+    return json.dumps(data).encode()
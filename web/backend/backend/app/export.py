@@ -0,0 +1,87 @@
+import base64
+import zlib
+import numpy as np
+from .map_gen import points_to_coordinates
+
+INT8 = 'int8'
+FLOAT32 = 'float32'
+DTYPES = (INT8, FLOAT32)
+
+# int8 value used for grid cells outside of the rooms
+INT8_NODATA = -128
+
+def encode_array(values, dtype, compress):
+    """
+    Returns the values as base64 of their raw little endian bytes, zlib
+    compressed if compress is set
+    """
+    if dtype == INT8:
+        encoded = np.where(np.isfinite(values),
+                           np.clip(np.round(values), -127, 127),
+                           INT8_NODATA).astype('<i1')
+    elif dtype == FLOAT32:
+        encoded = np.where(np.isfinite(values), values, np.nan).astype('<f4')
+    else:
+        raise ValueError(f"Unknown dtype '{dtype}'")
+
+    data = encoded.tobytes()
+    if compress:
+        data = zlib.compress(data)
+
+    return base64.b64encode(data).decode('ascii')
+
+def rooms_to_geojson(rooms):
+    features = []
+    for i, r in enumerate(rooms):
+        features.append({
+            'type': 'Feature',
+            'properties': {'index': i},
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [ring.tolist() for ring in r.rings()],
+            },
+        })
+
+    return {'type': 'FeatureCollection', 'features': features}
+
+def plan_to_data(plan, rooms, dtype=INT8, compress=True):
+    """
+    Returns the router placement, the intensity grid and the room outlines
+    of a CoveragePlan as a JSON serializable dict. The intensity grid is
+    row major with rows going north from grid origin, in dBm.
+    """
+    origin = plan.room_map.origin
+    routers = points_to_coordinates(origin, plan.router_positions())
+
+    x0, y0 = plan.grid_origin
+    rows, columns = plan.grid_shape
+    resolution = plan.grid_resolution
+    corners = points_to_coordinates(origin, [
+        (x0, y0),
+        (x0 + (columns - 1) * resolution, y0),
+        (x0 + (columns - 1) * resolution, y0 + (rows - 1) * resolution),
+        (x0, y0 + (rows - 1) * resolution),
+    ])
+
+    return {
+        'routers': routers.tolist(),
+        'cover': {
+            'method': plan.cover.method,
+            'size': plan.cover.size,
+            'gap': plan.cover.gap,
+        },
+        'intensity': {
+            'origin': [origin.longitude, origin.latitude],
+            'x0': x0,
+            'y0': y0,
+            'resolution': resolution,
+            'rows': rows,
+            'columns': columns,
+            'corners': corners.tolist(),
+            'dtype': dtype,
+            'nodata': INT8_NODATA if dtype == INT8 else None,
+            'compression': 'zlib' if compress else None,
+            'values': encode_array(plan.intensity_grid(), dtype, compress),
+        },
+        'rooms': rooms_to_geojson(rooms),
+    }
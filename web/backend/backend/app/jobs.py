@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+class Job:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.percent = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def report(self, stage, percent):
+        self.stage = stage
+        self.percent = percent
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'percent': round(self.percent, 1),
+            'error': self.error,
+        }
+
+class JobQueue:
+    """
+    Runs jobs on a local pool of background threads. Submitting a key that
+    already has a queued, running or finished job returns that job instead
+    of starting a new one. Only the latest max_finished finished jobs are
+    kept. When admission is given, every new job holds the context
+    admission() from being submitted until it finishes, so a full compute
+    pool can refuse it.
+    """
+    def __init__(self, max_workers, max_finished=256, admission=None):
+        self.max_finished = max_finished
+        self.admission = admission
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, func):
+        """
+        Schedules func(report) where report(stage, percent) updates the job
+        progress. Returns the Job.
+        """
+        with self._lock:
+            job = self._by_key.get(key)
+            if job is not None and job.status != FAILED:
+                return job
+
+            place = ExitStack()
+            if self.admission is not None:
+                place.enter_context(self.admission())
+
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+
+        self._pool.submit(self._run, job, func, place)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, func, place):
+        job.status = RUNNING
+        job.report('starting', 0.0)
+
+        try:
+            with place:
+                job.result = func(job.report)
+            job.report(DONE, 100.0)
+            job.status = DONE
+        except Exception as e:
+            logger.exception('Job %s failed', job.id)
+            job.error = str(e) or type(e).__name__
+            job.stage = FAILED
+            job.status = FAILED
+
+        job.finished = time.time()
+        self._trim()
+
+    def _trim(self):
+        with self._lock:
+            finished = [j for j in self._jobs.values()
+                        if j.status in (DONE, FAILED)]
+
+            for job in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job.id]
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
@@ -1,147 +1,301 @@
-import requests
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from shapely import Point, Polygon, MultiPolygon
+import shapely
+from scipy import sparse
+from shapely import Polygon, MultiPolygon
+from . import mazemap
+from . import metrics
 from . import solver
 from . import viz
-from .optimization import set_cover
+from .optimization import cover, coarse_to_fine_cover, EXACT
+from .partition import partitioned_cover, should_partition
+from .walls import segments_from_polygon
 import pickle
 
+# Number of room maps kept for reuse by get_room_map_for
+ROOM_MAP_CACHE_SIZE = 32
+
+# Router candidates apart from the grid points to cover: a separate grid, or
+# mountable positions along the walls and inside every part of the map
+GRID_CANDIDATES = 'grid'
+MOUNT_CANDIDATES = 'mounts'
+CANDIDATE_MODES = (GRID_CANDIDATES, MOUNT_CANDIDATES)
+
+# Default metres between router candidates
+CANDIDATE_SPACING = 1.0
+
+# Metres wall mounted candidates are moved off the wall, so the wall they
+# are mounted on does not count as one their signal passes through
+WALL_OFFSET = 0.1
+
+_room_maps = OrderedDict()
+_room_maps_lock = threading.Lock()
+
+# Where POIs come from and where room maps are kept across restarts, see
+# use_geometry_store
+_poi_source = mazemap
+_room_map_store = None
+_store_pid = None
+
 class Coordinate:
     def __init__(self, longitude, latitude):
         self.longitude = longitude
         self.latitude = latitude
 
 class Room:
+    """
+    Room outline and holes as (n, 2) arrays of longitude and latitude
+    """
     def __init__(self, origin, coordinates, holes):
         self.origin = origin
         self.coordinates = coordinates
         self.holes = holes
 
+    def rings(self):
+        return [self.coordinates] + self.holes
+
 class RoomMap:
-    def __init__(self, rooms):
+    """
+    The rooms merged into one MultiPolygon in metres from origin, with its
+    wall segments, prepared for point queries
+    """
+    def __init__(self, rooms, origin=None):
         assert len(rooms) > 0, "Map needs at least one room"
 
-        self.origin = rooms[0].origin
+        self.origin = origin or rooms[0].origin
         self.holes = []
 
+        # Project every ring of the floor in one go
+        rings = [ring for r in rooms for ring in r.rings()]
+        ring_ends = np.cumsum([len(ring) for ring in rings])[:-1]
+        ring_points = np.split(
+                coordinates_to_origin_points(self.origin, np.concatenate(rings)),
+                ring_ends)
+
         room_polygons = []
 
+        ring_index = 0
         for r in rooms:
-            points = coordinates_to_origin_points(self.origin, r.coordinates)
-            hole_points = []
-            for h in r.holes:
-                hole_point = coordinates_to_origin_points(self.origin, h)
-                hole_points.append(hole_point)
-                self.holes.append(hole_point)
+            points = ring_points[ring_index]
+            hole_points = ring_points[ring_index + 1:ring_index + len(r.rings())]
+            ring_index += len(r.rings())
 
+            self.holes.extend(hole_points)
             room_polygons.append(Polygon(points, holes=hole_points))
 
         # Merge rooms into single MultiPolygon
-        self.polygon = room_polygons[0]
-        for p in room_polygons[1:]:
-            self.polygon = self.polygon.union(p)
-
-        if self.polygon.geom_type == 'Polygon':
-            self.polygon = MultiPolygon([self.polygon])
-
+        polygon = shapely.union_all(room_polygons)
+        if polygon.geom_type == 'Polygon':
+            polygon = MultiPolygon([polygon])
+
+        self._set_polygon(polygon)
+
+    def _set_polygon(self, polygon, segments=None):
+        shapely.prepare(polygon)
+        self.polygon = polygon
+        self.bounds = polygon.bounds
+        if segments is None:
+            segments = segments_from_polygon(polygon)
+        self.segments = segments
+
+    def to_bytes(self):
+        """
+        Returns the room map as an npz archive holding the polygon as WKB
+        and its wall segments
+        """
+        holes = self.holes or [np.empty((0, 2))]
+        buf = io.BytesIO()
+        np.savez(buf,
+                 wkb=np.frombuffer(shapely.to_wkb(self.polygon), np.uint8),
+                 origin=np.array([self.origin.longitude,
+                                  self.origin.latitude]),
+                 hole_points=np.concatenate(holes),
+                 hole_ends=np.cumsum([len(h) for h in self.holes],
+                                     dtype=np.int64),
+                 segments=self.segments)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as archive:
+            room_map = cls.__new__(cls)
+            room_map.origin = Coordinate(*archive['origin'])
+            room_map.holes = np.split(archive['hole_points'],
+                                      archive['hole_ends'])[:-1]
+            segments = (archive['segments'] if 'segments' in archive.files
+                        else None)
+            room_map._set_polygon(shapely.from_wkb(archive['wkb'].tobytes()),
+                                  segments)
+
+        return room_map
+
+
+def get_room_map_for(rooms, origin=None):
+    """
+    Returns the RoomMap of the rooms, reusing the one built for an earlier
+    request with the same geometry
+    """
+    key = hash_rooms(rooms)
+    if origin is not None:
+        key += f':{origin.longitude!r},{origin.latitude!r}'
+
+    with _room_maps_lock:
+        room_map = _room_maps.get(key)
+        if room_map is not None:
+            _room_maps.move_to_end(key)
+            return room_map
+
+    store = _geometry_store()
+    data = store.load_room_map(key) if store is not None else None
+    if data is not None:
+        room_map = RoomMap.from_bytes(data)
+    else:
+        room_map = RoomMap(rooms, origin)
+        if store is not None:
+            store.save_room_map(key, room_map.to_bytes())
+
+    with _room_maps_lock:
+        _room_maps[key] = room_map
+        while len(_room_maps) > ROOM_MAP_CACHE_SIZE:
+            _room_maps.popitem(last=False)
+
+    return room_map
+
+def use_geometry_store(store):
+    """
+    Serves POIs from store instead of MazeMap and keeps built room maps in
+    it. store provides fetch_poi, fetch_pois and fetch_building_pois like
+    mazemap, and load_room_map(key) and save_room_map(key, data).
+    """
+    global _poi_source, _room_map_store, _store_pid
+
+    _poi_source = store
+    _room_map_store = store
+    _store_pid = os.getpid()
+
+def _geometry_store():
+    # Forked worker processes must not share the database connections of
+    # their parent, they build room maps themselves
+    if _store_pid != os.getpid():
+        return None
+
+    return _room_map_store
+
+def hash_rooms(rooms):
+    """
+    Returns a digest of the geometry of the rooms, in order
+    """
+    digest = hashlib.sha256()
+    for r in rooms:
+        digest.update(np.array([r.origin.longitude, r.origin.latitude],
+                               dtype=np.float64).tobytes())
+        for ring in r.rings():
+            ring = np.ascontiguousarray(ring, dtype=np.float64)
+            digest.update(np.int64(len(ring)).tobytes())
+            digest.update(ring.tobytes())
+
+    return digest.hexdigest()
 
 def degree_to_rad(d):
     return np.pi * d / 180.0
 
 def parse_room(rjson):
-    coord_map = lambda c: Coordinate(c[0], c[1])
+    coord_map = lambda c: np.array(c, dtype=np.float64)[:, :2].reshape(-1, 2)
 
     jcoords = rjson['geometry']['coordinates']
     jorigin = rjson['point']['coordinates']
 
-    coords = list(map(coord_map, jcoords[0]))
+    coords = coord_map(jcoords[0])
 
     holes = []
     for i in range(1, len(jcoords)):
-        holes.append(list(map(coord_map, jcoords[i])))
+        holes.append(coord_map(jcoords[i]))
 
     origin = Coordinate(jorigin[0], jorigin[1])
 
     return Room(origin, coords, holes)
 
 def fetch_room_from_url(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        rjson = response.json()
+    rjson = mazemap.get_json(url)
+    if rjson is not None:
         return parse_room(rjson)
 
     return None
 
 def fetch_room(poid):
-    url = f'https://api.mazemap.com/api/pois/{poid}?srid=4326'
-    response = requests.get(url)
-    if response.status_code == 200:
-        rjson = response.json()
+    rjson = _poi_source.fetch_poi(poid)
+    if rjson is not None:
         return parse_room(rjson)
 
     return None
 
 def fetch_rooms(poids):
-    rooms = []
-    for poid in poids:
-        room = fetch_room(poid)
-        if room:
-            rooms.append(room)
-
-    return rooms
+    return [parse_room(rjson) for rjson in _poi_source.fetch_pois(poids)
+            if rjson is not None]
 
 def fetch_floor(building_id, z):
-    from_id = 0
-    rooms = []
-
-    while True:
-        url = f'https://api.mazemap.com/api/pois/?buildingid={building_id}&fromid={from_id}&srid=4326'
-        response = requests.get(url)
+    return fetch_building(building_id).get(z, [])
 
-        if response.status_code != 200:
-            break
+def fetch_building(building_id):
+    """
+    Returns the rooms of every floor in the building, keyed by z
+    """
+    floors = {}
 
-        # Stop fetching when all rooms have been received
-        rjson = response.json()
-        pois = rjson['pois']
-        if len(pois) == 0:
-            break
+    for p in _poi_source.fetch_building_pois(building_id):
+        if p['identifier']:
+            floors.setdefault(int(p['z']), []).append(parse_room(p))
 
-        for p in pois:
-            ident = p['identifier']
-            pz = int(p['z'])
-            if ident and pz == z:
-                room = parse_room(p)
-                rooms.append(room)
+    return dict(sorted(floors.items()))
 
-        from_id = int(pois[-1]['poiId']) + 1
-
-    return rooms
-
-def coordinate_to_point(coord):
+def coordinates_to_points(coords):
+    """
+    Projects an (n, 2) array of longitude and latitude to an (n, 2) array
+    of points in metres
+    """
     EARTH_RADIUS = 6371000.0
 
-    lat = degree_to_rad(coord.latitude)
-    lon = degree_to_rad(coord.longitude)
+    lat = degree_to_rad(coords[:, 1])
+    lon = degree_to_rad(coords[:, 0])
 
     px = EARTH_RADIUS * np.cos(lat) * np.cos(lon)
     py = EARTH_RADIUS * np.cos(lat) * np.sin(lon)
 
-    return Point(px, py)
+    return np.column_stack([px, py])
 
-def coordinate_difference(start, end):
-    point_start = coordinate_to_point(start)
-    point_end = coordinate_to_point(end)
+def coordinates_to_origin_points(origin, coords):
+    """
+    Projects an (n, 2) array of longitude and latitude to points relative
+    to origin
+    """
+    origin_point = coordinates_to_points(
+            np.array([[origin.longitude, origin.latitude]]))
+
+    return coordinates_to_points(coords) - origin_point
+
+def points_to_coordinates(origin, points):
+    """
+    Inverse of coordinates_to_origin_points. Returns an (n, 2) array of
+    longitude and latitude, assuming the points are on the same hemisphere
+    as origin.
+    """
+    EARTH_RADIUS = 6371000.0
 
-    return Point(point_end.x - point_start.x, point_end.y - point_start.y)
+    origin_point = coordinates_to_points(
+            np.array([[origin.longitude, origin.latitude]]))
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2) + origin_point
 
-def coordinates_to_origin_points(origin, coords):
-    points = []
-    for c in coords:
-        p = coordinate_difference(origin, c)
-        points.append(p)
+    lon = np.arctan2(points[:, 1], points[:, 0])
+    cos_lat = np.minimum(np.hypot(points[:, 0], points[:, 1]) / EARTH_RADIUS,
+                         1.0)
+    lat = np.copysign(np.arccos(cos_lat), origin.latitude)
 
-    return points
+    return np.column_stack([lon, lat]) * 180.0 / np.pi
 
 def create_rectangular_grid(x0, y0, x1, y1, resolution):
     x = np.arange(x0, x1, resolution)
@@ -149,58 +303,358 @@ def create_rectangular_grid(x0, y0, x1, y1, resolution):
 
     xv, yv = np.meshgrid(x, y)
 
-    points = zip(xv.flatten(), yv.flatten())
-    return [Point(p[0], p[1]) for p in points]
+    return np.column_stack([xv.ravel(), yv.ravel()])
+
+def inside_mask(polygon, points):
+    """
+    Returns which points of an (n, 2) array lie strictly inside polygon
+    """
+    if not shapely.is_prepared(polygon):
+        shapely.prepare(polygon)
+    return shapely.contains_xy(polygon, points[:, 0], points[:, 1])
+
+def points_inside(polygon, points):
+    return points[inside_mask(polygon, points)]
+
+def grid_inside(room_map, grid_resolution):
+    """
+    Returns the shape of the grid over the bounds of room_map, and the
+    (row, column) index and position of its points inside the rooms
+    """
+    bounds = room_map.bounds
+    grid = create_rectangular_grid(
+            bounds[0], bounds[1], bounds[2], bounds[3], grid_resolution)
+    grid_shape = (len(np.arange(bounds[1], bounds[3], grid_resolution)),
+                  len(np.arange(bounds[0], bounds[2], grid_resolution)))
+
+    inside = np.flatnonzero(inside_mask(room_map.polygon, grid))
+    grid_index = np.column_stack(np.unravel_index(inside, grid_shape))
+
+    return grid_shape, grid_index, grid[inside]
+
+def candidate_positions(room_map, mode, spacing=None):
+    """
+    Returns the router candidates of a room map, either on a grid with the
+    given spacing or spaced along the walls plus one inside every part
+    """
+    assert mode in CANDIDATE_MODES, f"Unknown candidate mode '{mode}'"
+    spacing = spacing or CANDIDATE_SPACING
+
+    if mode == GRID_CANDIDATES:
+        bounds = room_map.bounds
+        return points_inside(room_map.polygon, create_rectangular_grid(
+                bounds[0], bounds[1], bounds[2], bounds[3], spacing))
+
+    starts, ends = room_map.segments[:, :2], room_map.segments[:, 2:]
+    lengths = np.hypot(*(ends - starts).T)
+    counts = np.maximum(1, (lengths // spacing).astype(np.int64))
+
+    # The middle of every one of the count equal parts of a wall
+    wall = np.repeat(np.arange(len(counts)), counts)
+    part = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                               counts)
+    t = (part + 0.5) / counts[wall]
+    mounts = starts[wall] + t[:, None] * (ends - starts)[wall]
+
+    # Off the wall on whichever side is inside
+    normals = (ends - starts)[wall][:, ::-1] * [-1, 1] / lengths[wall, None]
+    sides = np.concatenate([mounts + WALL_OFFSET * normals,
+                            mounts - WALL_OFFSET * normals])
+    centres = shapely.get_coordinates(shapely.point_on_surface(
+            shapely.get_parts(room_map.polygon)))
+
+    return np.concatenate([points_inside(room_map.polygon, sides), centres])
+
+def points_on_boundary(polygon, parts):
+    """
+    Returns parts + 1 equidistant points along each exterior edge of polygon
+    """
+    points = []
+    for poly in polygon.geoms:
+        vertices = np.asarray(poly.exterior.coords)[:-1]
+        edge_points = np.linspace(vertices[:-1], vertices[1:], parts + 1,
+                                  axis=1)
+        points.append(edge_points.reshape(-1, 2))
+
+    return np.concatenate(points)
 
-def get_router_coverage_map_from_poids(poids, grid_resolution, max_path_loss):
+def get_router_coverage_map_from_poids(poids, grid_resolution, max_path_loss,
+                                       cover_mode=EXACT, time_limit=None,
+                                       mip_rel_gap=None, workers=1):
     rooms = fetch_rooms(poids)
-    return get_router_coverage_map(rooms, grid_resolution, max_path_loss)
+    return get_router_coverage_map(rooms, grid_resolution, max_path_loss,
+                                   cover_mode, time_limit, mip_rel_gap,
+                                   workers)
 
 def get_room_map_from_poids(poids, grid_resolution):
     rooms = fetch_rooms(poids)
     return get_room_map(rooms, grid_resolution)
 
-def get_router_coverage_map_from_floor(building_id, z, grid_resolution):
+def get_router_coverage_map_from_floor(building_id, z, grid_resolution,
+                                       max_path_loss, cover_mode=EXACT,
+                                       time_limit=None, mip_rel_gap=None,
+                                       workers=1):
     rooms = fetch_floor(building_id, z)
-    return get_router_coverage_map(rooms, grid_resolution)
+    return get_router_coverage_map(rooms, grid_resolution, max_path_loss,
+                                   cover_mode, time_limit, mip_rel_gap,
+                                   workers)
 
 def get_room_map(rooms, grid_resolution):
-    room_map = RoomMap(rooms)
+    room_map = get_room_map_for(rooms)
 
-    bounds = room_map.polygon.bounds
+    bounds = room_map.bounds
     image = viz.show_room_map(room_map, bounds[0], bounds[1], bounds[2],
                               bounds[3], grid_resolution)
 
     return image
 
-def get_router_coverage_map(rooms, grid_resolution, max_path_loss):
-    room_map = RoomMap(rooms)
-
-    bounds = room_map.polygon.bounds
-    grid = create_rectangular_grid(
-            bounds[0], bounds[1], bounds[2], bounds[3], grid_resolution)
-
-    router_positions = list(filter(room_map.polygon.contains, grid))
-
-    covers = solver.solve(router_positions, room_map.polygon, max_path_loss)
-    router_coverages = set_cover(np.array(covers))
+def get_router_coverage_map(rooms, grid_resolution, max_path_loss,
+                            cover_mode=EXACT, time_limit=None,
+                            mip_rel_gap=None, workers=1, progress=None,
+                            coarse_factor=1, tile_size=None,
+                            candidate_mode=None, candidate_spacing=None):
+    """
+    Returns the coverage image and the CoverResult of the router placement.
+    progress(stage, percent) is called as the computation moves along.
+    """
+    plan = plan_router_coverage(rooms, grid_resolution, max_path_loss,
+                                cover_mode, time_limit, mip_rel_gap, workers,
+                                progress, coarse_factor, tile_size,
+                                candidate_mode, candidate_spacing)
+    image = render_router_coverage(plan)
+
+    return image, plan.cover
+
+class CoveragePlan:
+    """
+    Router placement and signal intensity for a room map. The first
+    point_count positions are the grid points inside the rooms, and
+    grid_index holds their (row, column) in the grid. The cover selects
+    among the candidates, or among the grid points when there are none.
+    """
+    def __init__(self, room_map, grid_origin, grid_shape, grid_resolution,
+                 grid_index, positions, point_count, cover, intensity,
+                 candidates=None):
+        self.room_map = room_map
+        self.grid_origin = grid_origin
+        self.grid_shape = grid_shape
+        self.grid_resolution = grid_resolution
+        self.grid_index = grid_index
+        self.positions = positions
+        self.point_count = point_count
+        self.cover = cover
+        self.intensity = intensity
+        self.candidates = candidates
+
+    def router_positions(self):
+        candidates = (self.positions if self.candidates is None
+                      else self.candidates)
+        return candidates[np.flatnonzero(self.cover.selection)]
+
+    def intensity_grid(self):
+        """
+        Returns the intensity at the grid points as a 2D array, with -inf
+        outside of the rooms
+        """
+        grid = np.full(self.grid_shape, -np.inf)
+        grid[self.grid_index[:, 0], self.grid_index[:, 1]] = \
+            self.intensity[:self.point_count]
+
+        return grid
+
+def plan_router_coverage(rooms, grid_resolution, max_path_loss,
+                         cover_mode=EXACT, time_limit=None, mip_rel_gap=None,
+                         workers=1, progress=None, coarse_factor=1,
+                         tile_size=None, candidate_mode=None,
+                         candidate_spacing=None):
+    """
+    Places routers and computes the resulting signal intensity. Returns a
+    CoveragePlan. progress(stage, percent) is called as the computation
+    moves along. With a coarse_factor above 1 routers are first placed on
+    a grid that much coarser, then refined around the chosen positions.
+
+    With a tile_size in metres, or when the floor has more grid points than
+    partition.PARTITION_POINTS, the floor is solved in independent pieces.
+
+    Routers are placed on the grid points they cover, unless a
+    candidate_mode is given. They are then placed on candidate_positions,
+    and the coverage matrix only has a row per candidate. The coarse_factor
+    and tile_size do not apply then.
+    """
+    progress = progress or (lambda stage, percent: None)
+
+    progress('preparing', 0.0)
+    with metrics.stage('room_map'):
+        room_map = get_room_map_for(rooms)
+
+    return plan_room_map(room_map, grid_resolution, max_path_loss,
+                         cover_mode, time_limit, mip_rel_gap, workers,
+                         progress, coarse_factor, tile_size, candidate_mode,
+                         candidate_spacing)
+
+def plan_room_map(room_map, grid_resolution, max_path_loss, cover_mode=EXACT,
+                  time_limit=None, mip_rel_gap=None, workers=1, progress=None,
+                  coarse_factor=1, tile_size=None, candidate_mode=None,
+                  candidate_spacing=None):
+    """
+    plan_router_coverage for a RoomMap that is already built
+    """
+    progress = progress or (lambda stage, percent: None)
+
+    bounds = room_map.bounds
+    with metrics.stage('grid'):
+        grid_shape, grid_index, router_positions = grid_inside(
+                room_map, grid_resolution)
+    metrics.count('grid_points', len(router_positions))
+
+    candidates = None
+    if candidate_mode is not None:
+        with metrics.stage('candidates'):
+            candidates = candidate_positions(room_map, candidate_mode,
+                                             candidate_spacing)
+        metrics.count('router_candidates', len(candidates))
+
+    # Coverage is by far the slowest stage, let it span most of the range
+    solve_progress = lambda done, total: progress('solving',
+                                                  5.0 + 75.0 * done / total)
+
+    if candidates is None and should_partition(len(router_positions),
+                                               tile_size):
+        router_cover = partitioned_cover(router_positions, room_map.polygon,
+                                         room_map.segments, max_path_loss,
+                                         tile_size, cover_mode, time_limit,
+                                         mip_rel_gap, workers, solve_progress,
+                                         grid_index, coarse_factor)
+
+        # The links of the pieces are not kept, intensity recomputes them
+        # for the chosen routers only
+        return finish_plan(room_map, (bounds[0], bounds[1]), grid_shape,
+                           grid_resolution, grid_index, router_positions,
+                           router_cover, None, max_path_loss, workers,
+                           progress)
+
+    with metrics.stage('solve'):
+        if candidates is None:
+            covers, links = solver.solve(router_positions, room_map.polygon,
+                                         max_path_loss, workers,
+                                         solve_progress, room_map.segments)
+        else:
+            candidates, covers, links = solve_candidates(
+                    candidates, router_positions, room_map, max_path_loss,
+                    workers, solve_progress)
+
+    return complete_plan(room_map, (bounds[0], bounds[1]), grid_shape,
+                         grid_resolution, grid_index, router_positions,
+                         covers, links, max_path_loss, cover_mode,
+                         time_limit, mip_rel_gap, workers, progress,
+                         coarse_factor=coarse_factor, candidates=candidates)
+
+def solve_candidates(candidates, demand_positions, room_map, max_path_loss,
+                     workers=1, progress=None):
+    """
+    Returns the candidates, the coverage matrix from them to the demand
+    positions and its Links. Demand positions that no candidate covers are
+    added as candidates of their own, so every position can be covered.
+    """
+    covers, links = solver.solve(candidates, room_map.polygon, max_path_loss,
+                                 workers, progress, room_map.segments,
+                                 demand_positions)
+
+    unreached = np.bincount(covers.indices,
+                            minlength=len(demand_positions)) == 0
+    if unreached.any():
+        extra = demand_positions[unreached]
+        extra_covers, extra_links = solver.solve(
+                extra, room_map.polygon, max_path_loss, workers, None,
+                room_map.segments, demand_positions)
+
+        candidates = np.concatenate([candidates, extra])
+        covers = sparse.vstack([covers, extra_covers], format='csr')
+        links = solver.stack_links(links, extra_links)
+
+    return candidates, covers, links
+
+def complete_plan(room_map, grid_origin, grid_shape, grid_resolution,
+                  grid_index, router_positions, covers, links, max_path_loss,
+                  cover_mode, time_limit, mip_rel_gap, workers, progress,
+                  initial=None, coarse_factor=1, candidates=None):
+    """
+    Chooses routers from the coverage matrix and computes their intensity.
+    The rows of the matrix are the candidates when they are given, the grid
+    points otherwise.
+    """
+    progress('optimizing', 80.0)
+    with metrics.stage('cover'):
+        if coarse_factor > 1 and candidates is None:
+            router_cover = coarse_to_fine_cover(covers, grid_index,
+                                                coarse_factor, cover_mode,
+                                                time_limit, mip_rel_gap,
+                                                initial)
+        else:
+            router_cover = cover(covers, cover_mode, time_limit, mip_rel_gap,
+                                 initial)
+
+    return finish_plan(room_map, grid_origin, grid_shape, grid_resolution,
+                       grid_index, router_positions, router_cover, links,
+                       max_path_loss, workers, progress, candidates)
+
+def finish_plan(room_map, grid_origin, grid_shape, grid_resolution,
+                grid_index, router_positions, router_cover, links,
+                max_path_loss, workers, progress, candidates=None):
+    """
+    Computes the intensity of the chosen routers and returns the CoveragePlan
+    """
+    router_coverages = router_cover.selection
 
     # Add extra points on boundary to improve visualization
-    list_of_points_on_boundary = []
-    for poly in room_map.polygon.geoms:
-        list_of_points_on_boundary.append((poly.exterior.coords[:-1]))
-    for i in list_of_points_on_boundary:
-        for j in range(len(i) - 1):
-            point_a = [i[j][0], i[j][1]]
-            point_b = [i[j+1][0], i[j+1][1]]
-            my_points_with_space = solver.get_equidistant_points(point_a, point_b, 4)
-            for k in my_points_with_space:
-                router_positions.append(Point(k[0], k[1]))
-
-    intensity = viz.intensity(router_coverages, router_positions,
-                              room_map.polygon, max_path_loss)
-    image = viz.create_intensity_map(router_coverages, intensity,
-                                     router_positions, room_map.polygon,
-                                     room_map.holes)
-
-    return image
+    point_count = len(router_positions)
+    router_positions = np.concatenate(
+            [router_positions, points_on_boundary(room_map.polygon, 4)])
+
+    progress('intensity', 90.0)
+    with metrics.stage('intensity'):
+        intensity = viz.intensity(router_coverages, router_positions,
+                                  room_map.polygon, max_path_loss, links,
+                                  workers, room_map.segments, candidates)
+
+    return CoveragePlan(room_map, grid_origin, grid_shape, grid_resolution,
+                        grid_index, router_positions, point_count,
+                        router_cover, intensity, candidates)
+
+def plan_building(floors, grid_resolution, max_path_loss, cover_mode=EXACT,
+                  time_limit=None, mip_rel_gap=None, workers=1,
+                  coarse_factor=1, tile_size=None, candidate_mode=None,
+                  candidate_spacing=None):
+    """
+    Plans every floor of a building and renders its coverage map. floors
+    maps z to the rooms of the floor. Returns a dict mapping z to the
+    CoveragePlan and PNG image of the floor. With workers > 1 the floors are
+    solved in parallel, a single floor gets all workers to itself.
+    """
+    floor_workers = workers if len(floors) == 1 else 1
+    args = [(rooms, grid_resolution, max_path_loss, cover_mode, time_limit,
+             mip_rel_gap, floor_workers, coarse_factor, tile_size,
+             candidate_mode, candidate_spacing)
+            for rooms in floors.values()]
+
+    if workers > 1 and len(args) > 1:
+        with ProcessPoolExecutor(min(workers, len(args))) as executor:
+            results = list(executor.map(_plan_floor, args))
+    else:
+        results = [_plan_floor(a) for a in args]
+
+    return dict(zip(floors.keys(), results))
+
+def _plan_floor(args):
+    # Floors report no progress
+    plan = plan_router_coverage(*args[:7], None, *args[7:])
+    return plan, viz.figure_to_png(render_router_coverage(plan))
+
+def render_router_coverage(plan):
+    with metrics.stage('render'):
+        return viz.create_intensity_map(plan.router_positions(),
+                                        plan.intensity_grid(),
+                                        plan.grid_origin,
+                                        plan.grid_resolution,
+                                        plan.room_map.polygon,
+                                        plan.room_map.holes)
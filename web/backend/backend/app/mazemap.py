@@ -0,0 +1,117 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+MAZEMAP_URL = 'https://api.mazemap.com'
+
+# Seconds to wait for connecting and for each read
+TIMEOUT = (3.05, 10.0)
+
+RETRIES = 3
+RETRY_BACKOFF = 0.3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Upper bound on requests in flight at once
+MAX_CONCURRENCY = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+def create_session(retries=RETRIES, backoff=RETRY_BACKOFF,
+                   pool_size=MAX_CONCURRENCY):
+    """
+    Returns a session with pooled connections which retries failed GET
+    requests with exponential backoff
+    """
+    # requests is only loaded once there is something to fetch
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=RETRY_STATUSES, allowed_methods=('GET',),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size,
+                          pool_maxsize=pool_size)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+def get_session():
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+
+        return _session
+
+def get_json(url, params=None, session=None, strict=False):
+    """
+    Returns the decoded JSON body of url, or None if it was not found. With
+    strict, any response but 200 raises requests.HTTPError instead.
+    """
+    session = session or get_session()
+    response = session.get(url, params=params, timeout=TIMEOUT)
+
+    if response.status_code == 200:
+        return response.json()
+
+    if strict:
+        import requests
+        raise requests.HTTPError(
+                f'{response.status_code} response from {response.url}',
+                response=response)
+
+    return None
+
+def fetch_poi(poid, session=None, base_url=None):
+    base_url = base_url or MAZEMAP_URL
+    return get_json(f'{base_url}/api/pois/{poid}', {'srid': 4326}, session)
+
+def fetch_pois(poids, session=None, base_url=None,
+               max_workers=MAX_CONCURRENCY):
+    """
+    Fetches the POIs concurrently. Returns them in the order of poids, with
+    None for POIs that were not found.
+    """
+    poids = list(poids)
+    if len(poids) <= 1:
+        return [fetch_poi(poid, session, base_url) for poid in poids]
+
+    session = session or get_session()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(poids))) as pool:
+        return list(pool.map(lambda poid: fetch_poi(poid, session, base_url),
+                             poids))
+
+def fetch_building_pois(building_id, session=None, base_url=None,
+                        strict=False):
+    """
+    Returns every POI in the building, fetched page by page. A page that
+    can not be fetched ends the building early, or raises
+    requests.HTTPError with strict.
+    """
+    base_url = base_url or MAZEMAP_URL
+    session = session or get_session()
+    from_id = 0
+    pois = []
+
+    while True:
+        rjson = get_json(f'{base_url}/api/pois/',
+                         {'buildingid': building_id, 'fromid': from_id,
+                          'srid': 4326}, session, strict)
+
+        if rjson is None:
+            break
+
+        # Stop fetching when all rooms have been received
+        page = rjson['pois']
+        if len(page) == 0:
+            break
+
+        pois.extend(page)
+        from_id = int(page[-1]['poiId']) + 1
+
+    return pois
@@ -0,0 +1,145 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds in seconds of the latency histogram buckets
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                     10.0, 30.0, 60.0)
+
+_current_trace = ContextVar('trace', default=None)
+
+class Trace:
+    """
+    Stage durations in seconds and counters of a single request
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def server_timing(self):
+        """
+        Returns the trace as a Server-Timing header value
+        """
+        entries = [f'{name};dur={seconds * 1000:.1f}'
+                   for name, seconds in self.stages.items()]
+        entries += [f'{name};desc="{value}"'
+                    for name, value in self.counters.items()]
+        return ', '.join(entries)
+
+class Histogram:
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets.append({'le': bound, 'count': cumulative})
+
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+class Metrics:
+    """
+    Latency histograms of every stage and counter totals, per endpoint
+    """
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, trace):
+        with self._lock:
+            entry = self._endpoints.setdefault(
+                    endpoint, {'requests': 0, 'stages': {}, 'counters': {}})
+            entry['requests'] += 1
+
+            for name, seconds in trace.stages.items():
+                if name not in entry['stages']:
+                    entry['stages'][name] = Histogram()
+                entry['stages'][name].observe(seconds)
+
+            for name, value in trace.counters.items():
+                entry['counters'][name] = entry['counters'].get(name, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    'requests': entry['requests'],
+                    'stages': {name: h.to_dict()
+                               for name, h in entry['stages'].items()},
+                    'counters': dict(entry['counters']),
+                }
+                for endpoint, entry in self._endpoints.items()
+            }
+
+registry = Metrics()
+
+@contextmanager
+def tracing(endpoint=None):
+    """
+    Collects the stages and counters recorded inside the block in a new
+    Trace, which is added to the registry under endpoint when one is given
+    """
+    trace = Trace()
+    token = _current_trace.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.add_time('total', time.perf_counter() - start)
+        _current_trace.reset(token)
+        if endpoint is not None:
+            registry.record(endpoint, trace)
+
+@contextmanager
+def stage(name):
+    """
+    Adds the time spent inside the block to the current trace, if any
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_time(name, time.perf_counter() - start)
+
+def count(name, value=1):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, int(value))
+
+def merge(trace):
+    """
+    Adds the stages and counters of a trace recorded elsewhere, e.g. in a
+    worker process, to the current trace
+    """
+    current = _current_trace.get()
+    if current is None:
+        return
+
+    for name, seconds in trace.stages.items():
+        # The worker's total is already part of the caller's stages
+        if name != 'total':
+            current.add_time(name, seconds)
+
+    for name, value in trace.counters.items():
+        current.count(name, value)
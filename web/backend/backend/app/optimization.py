@@ -1,22 +1,275 @@
-from scipy.optimize import milp, LinearConstraint, Bounds
+from scipy import sparse
 import numpy as np
+import heapq
 
-def set_cover(A):
-    A = A.T
-    c = np.ones_like(A[0])
-    constraints = LinearConstraint(A, lb=np.ones_like(A[0]))
+from . import metrics
+from .reduction import reduce_cover
+
+EXACT = 'exact'
+GREEDY = 'greedy'
+BOUNDED = 'bounded'
+
+COVER_MODES = (EXACT, GREEDY, BOUNDED)
+
+# Budget used by the bounded mode when no other limits are given
+BOUNDED_TIME_LIMIT = 10.0
+BOUNDED_GAP = 0.05
+
+class CoverResult:
+    def __init__(self, selection, lower_bound, method):
+        self.selection = selection
+        self.size = int(np.count_nonzero(selection))
+        self.lower_bound = min(lower_bound, self.size)
+        self.method = method
+
+        # Relative optimality gap, 0 when the cover is proven optimal
+        if self.size > 0:
+            self.gap = (self.size - self.lower_bound) / self.size
+        else:
+            self.gap = 0.0
+
+def set_cover(A, mode=EXACT, time_limit=None, mip_rel_gap=None):
+    """
+    Chooses the fewest rows of A such that every column is covered.
+    A can be dense or any scipy.sparse matrix with candidates as rows.
+    """
+    return cover(A, mode, time_limit, mip_rel_gap).selection
+
+def cover(A, mode=EXACT, time_limit=None, mip_rel_gap=None, initial=None):
+    """
+    Solves the set cover problem for A and returns a CoverResult.
+
+    GREEDY only runs the lazy greedy approximation. EXACT and BOUNDED both
+    use the greedy cover as an upper bound for the MILP, and fall back to it
+    if the MILP stops without a better solution. BOUNDED limits the MILP to
+    BOUNDED_TIME_LIMIT seconds and a relative gap of BOUNDED_GAP unless other
+    limits are given.
+
+    initial is an optional earlier selection, e.g. from before the map
+    changed. It is completed greedily and used when it beats the plain
+    greedy cover.
+    """
+    assert mode in COVER_MODES, f"Unknown cover mode '{mode}'"
+
+    A = _binary(A)
+    greedy = greedy_cover(A)
+    if initial is not None:
+        warm = greedy_cover(A, initial)
+        if warm.sum() < greedy.sum():
+            greedy = warm
+
+    greedy_size = int(greedy.sum())
+    lower_bound = _greedy_lower_bound(A, greedy_size)
+
+    if mode == GREEDY or lower_bound >= greedy_size:
+        return CoverResult(greedy, lower_bound, GREEDY)
+
+    # scipy.optimize takes long to import, load it with the first MILP
+    from scipy.optimize import milp, LinearConstraint, Bounds
+
+    if mode == BOUNDED:
+        time_limit = BOUNDED_TIME_LIMIT if time_limit is None else time_limit
+        mip_rel_gap = BOUNDED_GAP if mip_rel_gap is None else mip_rel_gap
+
+    # The MILP only sees what is left after removing dominated candidates
+    # and elements, the forced candidates are added back afterwards
+    with metrics.stage('reduction'):
+        reduction = reduce_cover(A)
+    R = reduction.A
+    forced_count = len(reduction.forced)
+    candidate_count, element_count = R.shape
+    metrics.count('candidates', A.shape[0])
+    metrics.count('reduced_candidates', candidate_count)
+
+    if element_count == 0:
+        selection = reduction.expand(np.zeros(candidate_count))
+        return CoverResult(selection, int(selection.sum()), mode)
+
+    c = np.ones(candidate_count)
+    constraints = [
+        LinearConstraint(R.T.tocsr(), lb=np.ones(element_count)),
+        # The greedy solution bounds the objective
+        LinearConstraint(np.ones((1, candidate_count)),
+                         ub=greedy_size - forced_count),
+    ]
     bounds = Bounds(lb=0, ub=1)
-    integrality = np.ones_like(A[0])
-    cover = milp(c=c, constraints=constraints, bounds=bounds, integrality=integrality)
+    integrality = np.ones(candidate_count)
+
+    options = {}
+    if time_limit is not None:
+        options['time_limit'] = time_limit
+    if mip_rel_gap is not None:
+        options['mip_rel_gap'] = mip_rel_gap
+
+    with metrics.stage('milp'):
+        result = milp(c=c, constraints=constraints, bounds=bounds,
+                      integrality=integrality, options=options)
+    metrics.count('milp_nodes', getattr(result, 'mip_node_count', 0) or 0)
+
+    dual_bound = getattr(result, 'mip_dual_bound', None)
+    if dual_bound is not None and np.isfinite(dual_bound):
+        # The objective is integral, so the bound can be rounded up
+        lower_bound = max(lower_bound,
+                          int(np.ceil(dual_bound - 1e-6)) + forced_count)
+
+    if result.x is None:
+        return CoverResult(greedy, lower_bound, GREEDY)
+
+    selection = reduction.expand(result.x > 0.5)
+    if selection.sum() >= greedy_size:
+        selection = greedy
+
+    if result.status == 0 and mip_rel_gap is None:
+        lower_bound = int(selection.sum())
+
+    return CoverResult(selection, lower_bound, mode)
+
+def coarse_to_fine_cover(A, grid_index, factor, mode=EXACT, time_limit=None,
+                         mip_rel_gap=None, initial=None):
+    """
+    Solves the set cover problem for A in two smaller steps. Candidates are
+    first limited to every factor-th grid point in both directions, then to
+    the grid points within factor cells of the routers chosen in the first
+    step. grid_index holds the (row, column) of every candidate.
+
+    The result can be larger than the optimal cover, its lower bound is the
+    one of the greedy cover on the full matrix.
+    """
+    from scipy.spatial import cKDTree
+
+    A = _binary(A)
+    grid_index = np.asarray(grid_index)
+
+    coarse = np.all(grid_index % factor == 0, axis=1)
+    first = _restricted_cover(A, _completed(A, coarse), mode, time_limit,
+                              mip_rel_gap)
+
+    chosen = np.flatnonzero(first.selection)
+    near = cKDTree(grid_index).query_ball_point(grid_index[chosen], factor,
+                                                p=np.inf)
+    refine = np.zeros(A.shape[0], dtype=bool)
+    refine[np.concatenate(near).astype(np.int64)] = True
+    if initial is not None:
+        refine |= np.asarray(initial) > 0
+        warm = np.where(refine, initial, 0)
+    else:
+        warm = first.selection
+
+    second = _restricted_cover(A, refine, mode, time_limit, mip_rel_gap, warm)
+
+    greedy = greedy_cover(A)
+    lower_bound = _greedy_lower_bound(A, int(greedy.sum()))
+    if greedy.sum() < second.size:
+        return CoverResult(greedy, lower_bound, GREEDY)
+
+    return CoverResult(second.selection, lower_bound, second.method)
+
+def _restricted_cover(A, candidates, mode, time_limit, mip_rel_gap,
+                      initial=None):
+    """
+    Solves the set cover problem using only the candidates in the mask
+    """
+    rows = np.flatnonzero(candidates)
+    if initial is not None:
+        initial = np.asarray(initial)[rows]
+
+    result = cover(A[rows], mode, time_limit, mip_rel_gap, initial)
+    selection = np.zeros(A.shape[0], dtype=np.int64)
+    selection[rows] = result.selection
+
+    return CoverResult(selection, result.lower_bound, result.method)
+
+def _completed(A, candidates):
+    """
+    Adds the candidates for elements that none of the candidates cover
+    """
+    covered = np.bincount(A[np.flatnonzero(candidates)].indices,
+                          minlength=A.shape[1]) > 0
+    missing = _coverable(A) & ~covered
+    if not missing.any():
+        return candidates
+
+    extra = np.unique(A.T.tocsr()[np.flatnonzero(missing)].indices)
+    candidates = candidates.copy()
+    candidates[extra] = True
+    return candidates
+
+def greedy_cover(A, initial=None):
+    """
+    Lazy greedy set cover. Repeatedly picks the row covering the most
+    uncovered columns, only re-evaluating rows when they reach the top of
+    the priority queue. Rows selected in initial are taken first, skipping
+    those that cover nothing new.
+    """
+    A = _binary(A)
+    candidate_count = A.shape[0]
+    indptr, indices = A.indptr, A.indices
+
+    uncovered = _coverable(A)
+    selection = np.zeros(candidate_count, dtype=np.int64)
+
+    if initial is not None:
+        for c in np.flatnonzero(initial):
+            members = indices[indptr[c]:indptr[c + 1]]
+            if np.any(uncovered[members]):
+                selection[c] = 1
+                uncovered[members] = False
+
+    remaining = np.count_nonzero(uncovered)
+
+    rows = np.repeat(np.arange(candidate_count), np.diff(indptr))
+    gains = np.bincount(rows, weights=uncovered[indices],
+                        minlength=candidate_count)
+
+    heap = [(-int(g), c) for c, g in enumerate(gains) if g > 0]
+    heapq.heapify(heap)
+
+    while remaining > 0 and heap:
+        _, c = heapq.heappop(heap)
+        members = indices[indptr[c]:indptr[c + 1]]
+        gain = np.count_nonzero(uncovered[members])
+
+        if gain == 0:
+            continue
+
+        # Gains only shrink, so a stale entry is pushed back with its
+        # current gain unless it still beats the next best
+        if heap and gain < -heap[0][0]:
+            heapq.heappush(heap, (-gain, c))
+            continue
+
+        selection[c] = 1
+        uncovered[members] = False
+        remaining -= gain
+
+    return selection
+
+def _binary(A):
+    A = sparse.csr_array(A, dtype=np.int8, copy=True)
+    A.eliminate_zeros()
+    A.data[:] = 1
+    return A
+
+def _coverable(A):
+    return np.bincount(A.indices, minlength=A.shape[1]) > 0
+
+def _greedy_lower_bound(A, greedy_size):
+    """
+    Greedy is within a factor H(k) of the optimum, where k is the largest
+    number of columns covered by a single row
+    """
+    if greedy_size == 0:
+        return 0
 
-    result = np.where(cover.x > 0.5, 1, 0)
-    return result
+    largest = int(np.diff(A.indptr).max())
+    harmonic = np.sum(1.0 / np.arange(1, largest + 1))
+    return max(1, int(np.ceil(greedy_size / harmonic - 1e-9)))
 
 def test_function():
     N = 5
     A = np.random.randint(2, size=(N, N))
     print(A)
-    res = set_cover(A)
+    res = cover(A)
 
-    print(f"solution: {res.x}")
-    print(res.success)
+    print(f"solution: {res.selection}")
+    print(f"gap: {res.gap}")
@@ -0,0 +1,214 @@
+import numpy as np
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from . import metrics
+from . import solver
+from .optimization import (CoverResult, cover, coarse_to_fine_cover, EXACT,
+                           GREEDY)
+
+# Floors with more grid points than this are partitioned when no tile size
+# is given
+PARTITION_POINTS = 40000
+
+# Default tile side, in router radii
+TILE_RADII = 8
+
+class Piece:
+    """
+    Part of a floor that is solved on its own. candidates are the indices of
+    the points routers may be placed on, core marks the candidates the piece
+    has to cover. Pieces of the same group may share routers, pieces of
+    different groups are too far apart to. cell is the (column, row) of the
+    tile within its group.
+    """
+    def __init__(self, candidates, core, group, cell=(0, 0)):
+        self.candidates = candidates
+        self.core = core
+        self.group = group
+        self.cell = cell
+
+def default_tile_size(max_path_loss):
+    return TILE_RADII * solver.router_radius(max_path_loss)
+
+def should_partition(point_count, tile_size):
+    return tile_size is not None or point_count > PARTITION_POINTS
+
+def partition(points, polygon, max_radius, tile_size):
+    """
+    Splits the points inside polygon into pieces. Parts of the polygon less
+    than max_radius apart are kept in the same group, and groups wider than
+    tile_size are cut into square tiles. The candidates of a tile include
+    the points within max_radius around it, so every router that can cover
+    its core is one of them.
+    """
+    parts = shapely.get_parts(polygon)
+    tree = shapely.STRtree(parts)
+    left, right = tree.query(parts, predicate='dwithin', distance=max_radius)
+    near = sparse.coo_array((np.ones(len(left)), (left, right)),
+                            shape=(len(parts), len(parts)))
+    group_count, part_group = connected_components(near, directed=False)
+
+    point_index, part_index = tree.query(shapely.points(points),
+                                         predicate='within')
+    group = np.full(len(points), -1)
+    group[point_index] = part_group[part_index]
+
+    pieces = []
+    for g in range(group_count):
+        members = np.flatnonzero(group == g)
+        if len(members) > 0:
+            pieces += _tiles(points, members, g, max_radius, tile_size)
+
+    return pieces
+
+def _tiles(points, members, group, margin, tile_size):
+    xy = points[members]
+    low = xy.min(axis=0)
+    cells = np.floor((xy - low) / tile_size).astype(np.int64)
+    if not cells.any():
+        return [Piece(members, np.ones(len(members), dtype=bool), group)]
+
+    tiles = []
+    for cell in np.unique(cells, axis=0):
+        tile_low = low + cell * tile_size - margin
+        tile_high = low + (cell + 1) * tile_size + margin
+        around = np.all((xy >= tile_low) & (xy <= tile_high), axis=1)
+
+        core = np.all(cells[around] == cell, axis=1)
+        tiles.append(Piece(members[around], core, group, tuple(cell)))
+
+    return tiles
+
+def partitioned_cover(points, polygon, segments, max_path_loss, tile_size=None,
+                      cover_mode=EXACT, time_limit=None, mip_rel_gap=None,
+                      workers=1, progress=None, grid_index=None,
+                      coarse_factor=1):
+    """
+    Solves router coverage piece by piece and returns a CoverResult for all
+    points. The routers chosen for the pieces cover every point, the ones
+    made redundant by routers of neighbouring tiles are dropped by a final
+    set cover over just the chosen routers. The lower bound sums the bounds
+    of tiles too far apart to share a router.
+    """
+    max_radius = solver.router_radius(max_path_loss)
+    if tile_size is None:
+        tile_size = default_tile_size(max_path_loss)
+    progress = progress or (lambda done, total: None)
+
+    with metrics.stage('partition'):
+        pieces = partition(points, polygon, max_radius, tile_size)
+    metrics.count('pieces', len(pieces))
+
+    args = [(points[p.candidates], _walls_near(segments, points[p.candidates]),
+             max_path_loss, p.core,
+             None if grid_index is None else grid_index[p.candidates],
+             cover_mode, time_limit, mip_rel_gap, coarse_factor)
+            for p in pieces]
+
+    with metrics.stage('pieces'):
+        if workers > 1 and len(args) > 1:
+            with ProcessPoolExecutor(min(workers, len(args))) as executor:
+                results = []
+                for result in executor.map(_solve_piece, args):
+                    results.append(result)
+                    progress(len(results), len(args))
+        else:
+            results = []
+            for a in args:
+                results.append(_solve_piece(a))
+                progress(len(results), len(args))
+
+    with metrics.stage('repair'):
+        return _stitch(len(points), pieces, results, cover_mode, time_limit,
+                       mip_rel_gap, _class_stride(max_radius, tile_size))
+
+def _class_stride(max_radius, tile_size):
+    """
+    Returns the stride k such that the cores of two tiles whose cells are
+    equal modulo k are more than 2 * max_radius apart, so no router covers
+    points of both. With the default tile size this is 2, the parity of
+    the cells.
+    """
+    return int(2 * max_radius // tile_size) + 2
+
+def _walls_near(segments, points):
+    """
+    Returns the walls that can cross a sight line between two of the points
+    """
+    low, high = points.min(axis=0), points.max(axis=0)
+    wall_low = np.minimum(segments[:, :2], segments[:, 2:])
+    wall_high = np.maximum(segments[:, :2], segments[:, 2:])
+
+    return segments[np.all(wall_high >= low, axis=1) &
+                    np.all(wall_low <= high, axis=1)]
+
+def _solve_piece(args):
+    (points, segments, max_path_loss, core, grid_index, cover_mode,
+     time_limit, mip_rel_gap, coarse_factor) = args
+
+    covers, _ = solver.solve(points, None, max_path_loss, segments=segments)
+    A = covers[:, np.flatnonzero(core)]
+
+    if coarse_factor > 1:
+        result = coarse_to_fine_cover(A, grid_index, coarse_factor,
+                                      cover_mode, time_limit, mip_rel_gap)
+    else:
+        result = cover(A, cover_mode, time_limit, mip_rel_gap)
+
+    # Any candidate of this piece may have been chosen by a neighbouring
+    # tile, so the coverage of every one of them is kept for the repair
+    return result, sparse.csr_array(A)
+
+def _stitch(point_count, pieces, results, cover_mode, time_limit,
+            mip_rel_gap, stride):
+    chosen = np.zeros(point_count, dtype=bool)
+    for piece, (result, _) in zip(pieces, results):
+        chosen[piece.candidates[np.flatnonzero(result.selection)]] = True
+
+    routers = np.flatnonzero(chosen)
+    router_row = np.full(point_count, -1)
+    router_row[routers] = np.arange(len(routers))
+
+    rows, cols = [], []
+    for piece, (_, R) in zip(pieces, results):
+        chosen_rows = np.flatnonzero(chosen[piece.candidates])
+        R = R[chosen_rows].tocoo()
+        rows.append(router_row[piece.candidates[chosen_rows]][R.row])
+        cols.append(piece.candidates[np.flatnonzero(piece.core)][R.col])
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    M = sparse.csr_array((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                         shape=(len(routers), point_count))
+
+    repair = cover(M, cover_mode, time_limit, mip_rel_gap)
+    selection = np.zeros(point_count, dtype=np.int64)
+    selection[routers[np.flatnonzero(repair.selection)]] = 1
+
+    # cover() also returns the greedy cover when it is proven optimal, only
+    # a greedy cover with a gap means the MILP was not used or gave up
+    fallbacks = [r for r in [result for result, _ in results] + [repair]
+                 if r.method == GREEDY and r.gap > 0]
+    method = GREEDY if fallbacks else cover_mode
+
+    return CoverResult(selection, _lower_bound(pieces, results, stride),
+                       method)
+
+def _lower_bound(pieces, results, stride):
+    """
+    Returns a lower bound on the routers of all pieces. Tiles of a group in
+    the same class of cells modulo stride need routers of their own, so
+    their bounds add up. Each group counts with its best class.
+    """
+    class_bounds = {}
+    for piece, (result, _) in zip(pieces, results):
+        key = (piece.group, tuple(np.asarray(piece.cell) % stride))
+        class_bounds[key] = class_bounds.get(key, 0) + result.lower_bound
+
+    group_bounds = {}
+    for (group, _), bound in class_bounds.items():
+        group_bounds[group] = max(group_bounds.get(group, 0), bound)
+
+    return sum(group_bounds.values())
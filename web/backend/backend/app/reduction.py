@@ -0,0 +1,171 @@
+import numpy as np
+from scipy import sparse
+
+# Reductions are repeated until nothing changes or this many passes are done
+MAX_PASSES = 8
+
+# Number of rows expanded to bitsets at a time
+PACK_BLOCK = 1024
+
+# Number of candidate subset pairs compared at a time
+PAIR_BLOCK = 2**16
+
+class Reduction:
+    """
+    A set cover instance after preprocessing. rows and columns index the
+    candidates and elements of the original matrix that are left in A, and
+    forced holds the candidates every cover has to pick.
+    """
+    def __init__(self, A, rows, columns, forced, candidate_count):
+        self.A = A
+        self.rows = rows
+        self.columns = columns
+        self.forced = forced
+        self.candidate_count = candidate_count
+
+    def expand(self, selection):
+        """
+        Returns the selection on the reduced matrix as a selection of
+        original candidates, including the forced ones
+        """
+        full = np.zeros(self.candidate_count, dtype=np.int64)
+        full[self.rows[np.flatnonzero(selection)]] = 1
+        full[self.forced] = 1
+        return full
+
+def reduce_cover(A):
+    """
+    Shrinks a binary set cover matrix with candidates as rows without
+    changing the size of the optimal cover:
+
+    - an element covered by a single candidate forces that candidate
+    - an element covered by every candidate of another element is dropped
+    - a candidate covering a subset of another candidate is dropped
+
+    Returns a Reduction.
+    """
+    A = sparse.csr_array(A, dtype=np.int8, copy=True)
+    A.eliminate_zeros()
+    A.data[:] = 1
+
+    candidate_count = A.shape[0]
+    rows = np.arange(candidate_count)
+    columns = np.flatnonzero(np.bincount(A.indices, minlength=A.shape[1]))
+    forced = []
+
+    M = A[:, columns]
+    for _ in range(MAX_PASSES):
+        size = M.shape
+
+        # Elements with a single candidate
+        counts = np.bincount(M.indices, minlength=M.shape[1])
+        single = np.flatnonzero(counts == 1)
+        if len(single) > 0:
+            picks = np.unique(M.T.tocsr()[single].indices)
+            forced.append(rows[picks])
+
+            covered = np.bincount(M[picks].indices, minlength=M.shape[1]) > 0
+            keep = np.ones(M.shape[0], dtype=bool)
+            keep[picks] = False
+            rows, columns = rows[keep], columns[~covered]
+            M = M[keep][:, ~covered]
+
+        # Elements whose candidates are a superset of another element's
+        covering = M.T.tocsr()
+        keep = ~_dominated(covering, keep_subsets=True)
+        columns = columns[keep]
+        M = M[:, keep]
+
+        # Candidates covering a subset of another candidate
+        keep = ~_dominated(M, keep_subsets=False) & (np.diff(M.indptr) > 0)
+        rows = rows[keep]
+        M = M[keep]
+
+        if M.shape == size:
+            break
+
+    forced = np.concatenate(forced) if forced else np.zeros(0, dtype=np.int64)
+    return Reduction(M.tocsr(), rows, columns, forced, candidate_count)
+
+def _dominated(M, keep_subsets):
+    """
+    Returns which rows of M are dropped by a row that is a superset of them,
+    or, when keep_subsets is set, a subset of them. Of identical rows the
+    first one is kept.
+    """
+    row_count = M.shape[0]
+    dropped = np.zeros(row_count, dtype=bool)
+    if row_count < 2:
+        return dropped
+
+    sub, sup = _subset_pairs(M)
+    size = np.diff(M.indptr)
+
+    # Equal sizes mean equal rows, then only the later one goes
+    strict = size[sub] < size[sup]
+    if keep_subsets:
+        dropped[sup[strict | (sub < sup)]] = True
+    else:
+        dropped[sub[strict | (sup < sub)]] = True
+
+    return dropped
+
+def _subset_pairs(M):
+    """
+    Returns all pairs (sub, sup) of distinct rows where the row sub of M is
+    a subset of the row sup
+    """
+    M = M.tocsr()
+    M.sort_indices()
+    indptr, indices = M.indptr, M.indices
+    size = np.diff(indptr)
+
+    # A superset has to contain the rarest element of the subset, so only
+    # the rows containing that element need to be compared
+    columns = M.T.tocsr()
+    counts = np.diff(columns.indptr)
+
+    nonempty = np.flatnonzero(size > 0)
+    element_counts = counts[indices]
+    rarest = np.minimum.reduceat(element_counts, indptr[nonempty])
+    is_rarest = np.flatnonzero(
+            element_counts == np.repeat(rarest, size[nonempty]))
+    owner = np.repeat(np.arange(M.shape[0]), size)[is_rarest]
+    _, first = np.unique(owner, return_index=True)
+    pivot = indices[is_rarest[first]]
+
+    sub = np.repeat(nonempty, counts[pivot])
+    sup = columns.indices[_ranges(columns.indptr[pivot], counts[pivot])]
+
+    candidate = (sub != sup) & (size[sup] >= size[sub])
+    sub, sup = sub[candidate], sup[candidate]
+
+    bits = _pack_rows(M)
+    subset = np.zeros(len(sub), dtype=bool)
+    for start in range(0, len(sub), PAIR_BLOCK):
+        stop = min(start + PAIR_BLOCK, len(sub))
+        missing = bits[sub[start:stop]] & ~bits[sup[start:stop]]
+        subset[start:stop] = ~missing.any(axis=1)
+
+    return sub[subset], sup[subset]
+
+def _ranges(starts, lengths):
+    """
+    Returns the concatenation of arange(start, start + length) for all pairs
+    """
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+def _pack_rows(M):
+    """
+    Returns the rows of M as bitsets, one bit per column, in 64 bit words
+    """
+    word_count = (M.shape[1] + 63) // 64
+    blocks = []
+    for start in range(0, M.shape[0], PACK_BLOCK):
+        dense = M[start:start + PACK_BLOCK].toarray() != 0
+        packed = np.zeros((len(dense), word_count * 8), dtype=np.uint8)
+        packed[:, :(M.shape[1] + 7) // 8] = np.packbits(dense, axis=1)
+        blocks.append(packed.view(np.uint64))
+
+    return np.concatenate(blocks)
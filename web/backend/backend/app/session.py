@@ -0,0 +1,252 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+
+from . import metrics
+from . import solver
+from .map_gen import get_room_map_for, complete_plan, inside_mask
+from .optimization import EXACT
+from .walls import wall_tree, count_crossings
+
+# Walls are compared at this precision when looking for changes
+WALL_PRECISION = 1e-6
+
+# Offset making lattice coordinates positive when packing them in one int64
+_KEY_OFFSET = 2**30
+
+class CoverageSession:
+    """
+    Keeps the grid points, links and router placement of a map between
+    updates. The grid is a lattice anchored at the origin of the first
+    update, so points keep their position when rooms are added or removed.
+    An update only recomputes the links of new points and of sight lines
+    touching walls that changed, and starts set cover from the previous
+    placement.
+    """
+    def __init__(self, grid_resolution, max_path_loss):
+        self.grid_resolution = grid_resolution
+        self.max_path_loss = max_path_loss
+        self.max_radius = solver.router_radius(max_path_loss)
+        self.lock = threading.Lock()
+
+        self.origin = None
+        self.keys = np.empty((0, 2), dtype=np.int64)
+        self.segments = np.empty((0, 4))
+        self.links = None
+        self.selection = None
+
+    def update(self, rooms, cover_mode=EXACT, time_limit=None,
+               mip_rel_gap=None, workers=1, progress=None,
+               coarse_factor=1):
+        """
+        Returns the CoveragePlan for the new room selection
+        """
+        progress = progress or (lambda stage, percent: None)
+        progress('preparing', 0.0)
+
+        if self.origin is None:
+            self.origin = rooms[0].origin
+
+        with metrics.stage('room_map'):
+            room_map = get_room_map_for(rooms, self.origin)
+            segments = room_map.segments
+
+        with metrics.stage('grid'):
+            keys, lattice_origin, grid_shape = self._lattice(
+                    room_map.bounds)
+            points = keys * self.grid_resolution
+            inside = inside_mask(room_map.polygon, points)
+            keys, points = keys[inside], points[inside]
+            grid_index = (keys - lattice_origin)[:, ::-1]
+        metrics.count('grid_points', len(points))
+
+        solve_progress = lambda done, total: progress(
+                'solving', 5.0 + 75.0 * done / total)
+
+        with metrics.stage('solve'):
+            if self.links is None:
+                old_index = np.full(len(keys), -1)
+                links = solver.find_links(points, room_map.polygon,
+                                          self.max_radius, workers,
+                                          solve_progress, segments)
+            else:
+                old_index = self._old_index(keys)
+                links = self._update_links(points, old_index, segments)
+                solve_progress(1, 1)
+
+            covers = links.coverage(self.max_path_loss)
+
+        initial = None
+        if self.selection is not None:
+            kept = old_index >= 0
+            initial = np.zeros(len(points), dtype=np.int64)
+            initial[kept] = self.selection[old_index[kept]]
+
+        plan = complete_plan(room_map,
+                             tuple(lattice_origin * self.grid_resolution),
+                             grid_shape, self.grid_resolution, grid_index,
+                             points, covers, links, self.max_path_loss,
+                             cover_mode, time_limit, mip_rel_gap, workers,
+                             progress, initial, coarse_factor)
+
+        self.keys = keys
+        self.segments = segments
+        self.links = links
+        self.selection = plan.cover.selection
+
+        return plan
+
+    def _lattice(self, bounds):
+        """
+        Returns the (x, y) lattice coordinates of the points covering bounds,
+        the coordinates of the first point and the (rows, columns) shape
+        """
+        x0, y0 = np.ceil(np.array(bounds[:2]) / self.grid_resolution)
+        x1, y1 = np.floor(np.array(bounds[2:]) / self.grid_resolution)
+
+        x = np.arange(x0, x1 + 1, dtype=np.int64)
+        y = np.arange(y0, y1 + 1, dtype=np.int64)
+        xv, yv = np.meshgrid(x, y)
+
+        keys = np.column_stack([xv.ravel(), yv.ravel()])
+        return keys, np.array([x0, y0], dtype=np.int64), (len(y), len(x))
+
+    def _old_index(self, keys):
+        """
+        Returns the index of every lattice point in the previous update, or
+        -1 for new points
+        """
+        old_codes = _pack(self.keys)
+        order = np.argsort(old_codes)
+        sorted_codes = old_codes[order]
+
+        codes = _pack(keys)
+        position = np.minimum(np.searchsorted(sorted_codes, codes),
+                              max(len(sorted_codes) - 1, 0))
+
+        if len(sorted_codes) == 0:
+            return np.full(len(keys), -1)
+
+        found = sorted_codes[position] == codes
+        return np.where(found, order[position], -1)
+
+    def _update_links(self, points, old_index, segments):
+        from scipy.spatial import cKDTree
+
+        wall_index = wall_tree(segments)
+
+        # Pairs between points that are still on the map
+        new_of_old = np.full(self.links.shape[0], -1)
+        kept = np.flatnonzero(old_index >= 0)
+        new_of_old[old_index[kept]] = kept
+
+        rows, cols, d, intersecting_walls = self.links.upper_pairs()
+        rows, cols = new_of_old[rows], new_of_old[cols]
+        alive = (rows >= 0) & (cols >= 0)
+        rows, cols = np.minimum(rows, cols)[alive], np.maximum(rows, cols)[alive]
+        d, intersecting_walls = d[alive], intersecting_walls[alive].copy()
+
+        # Only sight lines near changed walls can have a different count
+        changed = changed_segments(self.segments, segments)
+        if len(changed) > 0 and len(rows) > 0:
+            lines = shapely.linestrings(
+                    np.stack([points[rows], points[cols]], axis=1))
+            touched = np.unique(wall_tree(changed).query(lines)[0])
+            metrics.count('line_of_sight_tests', len(touched))
+            intersecting_walls[touched] = count_crossings(
+                    points[cols[touched]], points[rows[touched]], segments,
+                    wall_index)
+
+        # Pairs involving points that are new on the map
+        new_points = np.flatnonzero(old_index < 0)
+        neighbours = cKDTree(points).query_ball_point(
+                points[new_points], self.max_radius * (1 + 1e-9))
+
+        counts = [len(n) for n in neighbours]
+        new_rows = np.repeat(new_points, counts)
+        new_cols = np.fromiter(itertools.chain.from_iterable(neighbours),
+                               dtype=np.int64, count=sum(counts))
+
+        # Pairs of two new points show up twice, keep one of them
+        once = (old_index[new_cols] >= 0) | (new_rows <= new_cols)
+        new_rows, new_cols = new_rows[once], new_cols[once]
+        new_rows, new_cols = (np.minimum(new_rows, new_cols),
+                              np.maximum(new_rows, new_cols))
+
+        new_d = np.hypot(points[new_rows, 0] - points[new_cols, 0],
+                         points[new_rows, 1] - points[new_cols, 1])
+        in_range = new_d <= self.max_radius
+        new_rows, new_cols = new_rows[in_range], new_cols[in_range]
+        new_d = new_d[in_range]
+        new_walls = count_crossings(points[new_cols], points[new_rows],
+                                    segments, wall_index)
+        metrics.count('line_of_sight_tests', len(new_rows))
+
+        return solver.links_from_pairs(
+                len(points),
+                np.concatenate([rows, new_rows]),
+                np.concatenate([cols, new_cols]),
+                np.concatenate([d, new_d]),
+                np.concatenate([intersecting_walls, new_walls]),
+                self.max_radius)
+
+class SessionStore:
+    """
+    Keeps the max_sessions most recently used sessions
+    """
+    def __init__(self, max_sessions):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, grid_resolution, max_path_loss):
+        """
+        Returns the session with the given id, starting a new one if it does
+        not exist or was made for other parameters
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if (session is None or
+                    session.grid_resolution != grid_resolution or
+                    session.max_path_loss != max_path_loss):
+                session = CoverageSession(grid_resolution, max_path_loss)
+                self._sessions[session_id] = session
+
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+            return session
+
+def changed_segments(old, new):
+    """
+    Returns the walls that are only in old or only in new
+    """
+    old_keys = _segment_keys(old)
+    new_keys = _segment_keys(new)
+
+    old_set = set(old_keys)
+    new_set = set(new_keys)
+    removed = [k not in new_set for k in old_keys]
+    added = [k not in old_set for k in new_keys]
+
+    return np.concatenate([old[np.array(removed, dtype=bool)],
+                           new[np.array(added, dtype=bool)]]).reshape(-1, 4)
+
+def _segment_keys(segments):
+    q = np.round(np.asarray(segments) / WALL_PRECISION).astype(np.int64)
+    start, end = q[:, :2], q[:, 2:]
+
+    # The same wall can be stored in either direction
+    swap = (start[:, 0] > end[:, 0]) | ((start[:, 0] == end[:, 0]) &
+                                         (start[:, 1] > end[:, 1]))
+    q[swap] = np.hstack([end[swap], start[swap]])
+
+    return list(map(tuple, q.tolist()))
+
+def _pack(keys):
+    keys = keys + _KEY_OFFSET
+    return keys[:, 0] * (2 * _KEY_OFFSET) + keys[:, 1]
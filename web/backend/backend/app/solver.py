@@ -1,70 +1,272 @@
+import itertools
 import numpy as np
-from shapely import LineString, MultiPolygon
-from shapely.geometry import CAP_STYLE, JOIN_STYLE
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+from . import metrics
+from .walls import (WALL_TOLERANCE, segments_from_polygon, wall_tree,
+                    count_crossings)
 
-WALL_TOLERANCE = 0.20
+# Candidate rows handled per batch of line of sight tests
+ROW_BLOCK = 256
+
+# Geometry of the map being solved, set once per worker process
+_worker_state = {}
 
 class Wall:
     WOOD = 1
     CONCRETE = 2
 
-def solve(router_positions, map_polygon, max_path_loss):
+# Radio model, frequency in MHz and loss in dB per wall of each material
+FREQUENCY = 5.2e3
+DISTANCE_POWER_LOSS = 31
+WALL_LOSS = {
+    Wall.WOOD: 2.67,
+    Wall.CONCRETE: 2.73,
+}
+
+class Links:
+    """
+    Distance and number of intersecting walls for every pair of points no
+    farther apart than max_radius, stored row wise like a CSR matrix. Rows
+    are router positions, columns are the points to cover, which are the
+    same points unless column_count is given.
+    """
+    def __init__(self, indptr, indices, distances, walls, max_radius,
+                 column_count=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.distances = distances
+        self.walls = walls
+        self.max_radius = max_radius
+
+        row_count = len(indptr) - 1
+        self.shape = (row_count,
+                      row_count if column_count is None else column_count)
+
+    def row(self, i):
+        s = slice(self.indptr[i], self.indptr[i + 1])
+        return self.indices[s], self.distances[s], self.walls[s]
+
+    def upper_pairs(self):
+        """
+        Returns rows, cols, distances and walls of the pairs with row <= col
+        """
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        upper = rows <= self.indices
+
+        return (rows[upper], self.indices[upper], self.distances[upper],
+                self.walls[upper])
+
+    def coverage(self, max_path_loss):
+        """
+        Returns the sparse coverage matrix with candidates as rows
+        """
+        radii = wall_radii(max_path_loss, self.walls.max(initial=0))
+        covered = self.distances <= radii[self.walls]
+
+        coverage = sparse.csr_array(
+                (covered.astype(np.int8), self.indices.copy(),
+                 self.indptr.copy()), shape=self.shape)
+        coverage.eliminate_zeros()
+
+        return coverage
+
+def solve(router_positions, map_polygon, max_path_loss, workers=1,
+          progress=None, segments=None, demand_positions=None):
+    """
+    Returns the sparse coverage matrix of the router positions and the Links
+    it was computed from. With workers > 1 the rows are split across a
+    process pool. progress(done, total) is called as candidate rows finish.
+    segments are the walls of map_polygon, if they are already known.
+
+    The router positions also are the points to cover, unless
+    demand_positions are given. The matrix then has a row per router
+    position and a column per demand position.
+    """
     MAX_RADIUS = router_radius(max_path_loss)
-    access_point_covers = []
+    points = np.asarray(router_positions, dtype=np.float64).reshape(-1, 2)
+    if demand_positions is not None:
+        demand_positions = np.asarray(demand_positions,
+                                      dtype=np.float64).reshape(-1, 2)
+
+    links = find_links(points, map_polygon, MAX_RADIUS, workers, progress,
+                       segments, demand_positions)
+    access_point_covers = links.coverage(max_path_loss)
+
+    return access_point_covers, links
+
+def find_links(points, map_polygon, max_radius, workers=1, progress=None,
+               segments=None, targets=None):
+    """
+    Returns the Links between points, or from points to targets when they
+    are given
+    """
+    if segments is None:
+        segments = segments_from_polygon(map_polygon)
+    blocks = [(start, min(start + ROW_BLOCK, len(points)))
+              for start in range(0, len(points), ROW_BLOCK)]
+    progress = progress or (lambda done, total: None)
+
+    pairs = []
+    if workers > 1 and len(blocks) > 1:
+        # The geometry is sent once to every worker, not with every block
+        with ProcessPoolExecutor(max_workers=min(workers, len(blocks)),
+                                 initializer=_init_link_worker,
+                                 initargs=(points, segments, max_radius,
+                                           targets)) as pool:
+            for (_, stop), block_pairs in zip(blocks,
+                                              pool.map(_link_block,
+                                                       *zip(*blocks))):
+                pairs.append(block_pairs)
+                progress(stop, len(points))
+    else:
+        context = _link_context(points, segments, max_radius, targets)
+        for start, stop in blocks:
+            pairs.append(_link_block(start, stop, context))
+            progress(stop, len(points))
+
+    rows, cols, d, intersecting_walls = map(np.concatenate, zip(*pairs))
+    metrics.count('line_of_sight_tests', len(rows))
+
+    if targets is not None:
+        return _sorted_links(len(points), rows, cols, d, intersecting_walls,
+                             max_radius, len(targets))
 
-    pindex = 0
-    for access_point_candidate in router_positions:
-        print(f'{pindex}/{len(router_positions) - 1}')
-        pindex += 1
+    return links_from_pairs(len(points), rows, cols, d, intersecting_walls,
+                            max_radius)
 
-        access_point_cover = np.zeros(len(router_positions)) # number of points
-        for i in range(len(router_positions)):
-            point = router_positions[i]
-            d = distance(point, access_point_candidate)
+def links_from_pairs(point_count, rows, cols, d, intersecting_walls,
+                     max_radius):
+    """
+    Builds Links from pairs with row <= col. Line of sight is symmetric, so
+    every pair is mirrored.
+    """
+    mirrored = rows != cols
+    rows, cols = (np.concatenate([rows, cols[mirrored]]),
+                  np.concatenate([cols, rows[mirrored]]))
+    d = np.concatenate([d, d[mirrored]])
+    intersecting_walls = np.concatenate([intersecting_walls,
+                                         intersecting_walls[mirrored]])
 
-            if d > MAX_RADIUS:
-                continue
+    return _sorted_links(point_count, rows, cols, d, intersecting_walls,
+                         max_radius)
 
-            intersecting_walls = check_line_of_sight(point,
-                                                     access_point_candidate,
-                                                     map_polygon)
-            radius = router_radius(max_path_loss, intersecting_walls)
+def stack_links(links, more):
+    """
+    Returns the Links with the rows of more below those of links. Both must
+    have the same columns.
+    """
+    indptr = np.concatenate([links.indptr, more.indptr[1:] + links.indptr[-1]])
 
-            if d <= radius:
-                access_point_cover[i] = 1
+    return Links(indptr, np.concatenate([links.indices, more.indices]),
+                 np.concatenate([links.distances, more.distances]),
+                 np.concatenate([links.walls, more.walls]), links.max_radius,
+                 links.shape[1])
 
-        access_point_covers.append(access_point_cover)
+def _sorted_links(row_count, rows, cols, d, intersecting_walls, max_radius,
+                  column_count=None):
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(row_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=row_count), out=indptr[1:])
 
-    return access_point_covers
+    return Links(indptr, cols[order], d[order], intersecting_walls[order],
+                 max_radius, column_count)
+
+def _link_context(points, segments, max_radius, targets=None):
+    # scipy.spatial takes long to import, load it with the first solve
+    from scipy.spatial import cKDTree
+
+    return {
+        'points': points,
+        'targets': targets,
+        'target_tree': cKDTree(points if targets is None else targets),
+        'segments': segments,
+        'wall_index': wall_tree(segments),
+        'max_radius': max_radius,
+    }
+
+def _init_link_worker(points, segments, max_radius, targets=None):
+    _worker_state.update(_link_context(points, segments, max_radius, targets))
+
+def _link_block(start, stop, context=None):
+    if context is None:
+        context = _worker_state
+
+    return pairs_in_range(context['points'], context['target_tree'],
+                          context['segments'], context['wall_index'],
+                          start, stop, context['max_radius'],
+                          context['targets'])
+
+def pairs_in_range(points, target_tree, segments, wall_index, start, stop,
+                   max_radius, targets=None):
+    """
+    Finds every pair (i, j) with start <= i < stop, i <= j and points no
+    farther apart than max_radius. With targets, j is an index into targets
+    and every pair in range is found. target_tree indexes the targets, or
+    the points when there are none. Returns the pair indices, their distance
+    and the number of walls between them.
+    """
+    symmetric = targets is None
+    if symmetric:
+        targets = points
+
+    # Widen the query slightly, the exact cut off is done below
+    neighbours = target_tree.query_ball_point(points[start:stop],
+                                              max_radius * (1 + 1e-9))
+
+    counts = [len(n) for n in neighbours]
+    rows = np.repeat(np.arange(start, stop), counts)
+    cols = np.fromiter(itertools.chain.from_iterable(neighbours),
+                       dtype=np.int64, count=sum(counts))
+
+    d = np.hypot(points[rows, 0] - targets[cols, 0],
+                 points[rows, 1] - targets[cols, 1])
+    keep = d <= max_radius
+    if symmetric:
+        keep &= rows <= cols
+    rows, cols, d = rows[keep], cols[keep], d[keep]
+
+    intersecting_walls = count_crossings(targets[cols], points[rows],
+                                         segments, wall_index)
+
+    return rows, cols, d, intersecting_walls
+
+def wall_radii(max_loss, max_walls):
+    """
+    Returns the router radius for 0 to max_walls intersecting walls
+    """
+    return coverage_radius(max_loss, concrete=np.arange(max_walls + 1))
+
+def wall_loss(concrete=0, wood=0):
+    """
+    Returns the loss through the given numbers of walls, which can be arrays
+    """
+    return (np.multiply(concrete, WALL_LOSS[Wall.CONCRETE]) +
+            np.multiply(wood, WALL_LOSS[Wall.WOOD]))
+
+def coverage_radius(max_loss, concrete=0, wood=0):
+    """
+    Returns the distance at which the path loss reaches max_loss through the
+    given numbers of walls. Arguments can be arrays and are broadcast.
+    """
+    exponent = (max_loss - 20 * np.log10(FREQUENCY) - wall_loss(concrete, wood)
+                + 20)
+    return 10**(exponent / DISTANCE_POWER_LOSS)
+
+def propagation_loss(d, concrete=0, wood=0):
+    """
+    Returns the path loss over distances d through the given numbers of
+    walls. Arguments can be arrays and are broadcast.
+    """
+    return (20 * np.log10(FREQUENCY) + DISTANCE_POWER_LOSS * np.log10(d)
+            + wall_loss(concrete, wood) - 20)
 
 def router_radius(max_loss, walls = []):
-    f = 5.2e3
-    N = 31
-    P_f = lambda wall_list: sum([2.73 if wall == Wall.CONCRETE else 2.67
-                                 for wall in wall_list])
-    exponent = max_loss - 20 * np.log10(f) - P_f(walls) + 20
-    d = 10**(exponent / N)
-    return d
+    return coverage_radius(max_loss, *_material_counts(walls))
 
 def check_line_of_sight(start, end, polygon):
-    line = LineString([start, end])
-    intersection = polygon.boundary.intersection(line)
-
-    if intersection.geom_type == 'Point':
-        num_intersections = 1
-    elif intersection.geom_type == 'MultiPoint':
-        intersection_points = list(set(list(intersection.geoms)))
-        num_intersections = len(intersection_points)
-
-        # Disregard duplicate intersections
-        for i in range(len(intersection_points)):
-            for j in range(i + 1, len(intersection_points)):
-                p0 = intersection_points[i]
-                p1 = intersection_points[j]
-                if distance(p0, p1) < WALL_TOLERANCE:
-                    num_intersections -= 1
-    else:
-        num_intersections = 0
+    num_intersections = count_crossings([start.x, start.y], [end.x, end.y],
+                                        segments_from_polygon(polygon))[0]
 
     return [Wall.CONCRETE for _ in range(num_intersections)]
 
@@ -77,10 +279,11 @@ def distance(p0, p1):
     return np.sqrt(dx**2 + dy**2)
 
 def path_loss(d, walls = []):
-    f = 5.2e3
-    N = 31
-    P_f = lambda wall_list: sum([2.73 if wall == Wall.CONCRETE else 2.67 for wall in wall_list])
-    return 20 * np.log10(f) + N * np.log10(d) + P_f(walls) - 20
+    return propagation_loss(d, *_material_counts(walls))
+
+def _material_counts(walls):
+    concrete = sum(1 for wall in walls if wall == Wall.CONCRETE)
+    return concrete, len(walls) - concrete
 
 def get_equidistant_points(p1, p2, parts):
     list_of_tuples = list(zip(np.linspace(p1[0], p2[0], parts+1),
@@ -1,102 +1,414 @@
+import io
+import os
 import numpy as np
-from .solver import distance, check_line_of_sight, path_loss, router_radius
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-import matplotlib.path as mpath
+from concurrent.futures import ProcessPoolExecutor
+from .solver import propagation_loss, router_radius
+from .walls import segments_from_polygon, wall_tree, count_crossings
 
 SIGNAL_DISTANCE_CUTOFF = 0.1
 
-def intensity(router_coverages, router_positions, map_polygon, max_path_loss):
+# Router and point pairs evaluated at a time. count_crossings splits the
+# walls their lines touch into blocks of at most walls.CHUNK_SIZE.
+INTENSITY_CHUNK_SIZE = 2**16
+
+# zlib level of the PNGs of Pillow Images, the maps have large flat areas
+# that the fastest levels already compress well
+PNG_COMPRESS_LEVEL = 1
+
+# Geometry of the map being rendered, set once per worker process
+_worker_state = {}
+
+def intensity(router_coverages, router_positions, map_polygon, max_path_loss,
+              links=None, workers=1, segments=None, candidate_positions=None):
+    """
+    Returns the strongest signal at every position. The first
+    len(router_coverages) positions are the solver points, the rest are extra
+    points on the boundary. When the solver Links are given, the signal at
+    the solver points is read from them instead of being recomputed. With
+    workers > 1 the routers are split across a process pool.
+
+    With candidate_positions, router_coverages selects routers among them
+    rather than among the solver points, and the solver points are the
+    first links.shape[1] positions.
+    """
     MAX_RADIUS = router_radius(max_path_loss)
 
-    result = np.ones_like(router_positions) * (-np.inf)
-    point_count = len(router_coverages)
+    points = np.asarray(router_positions, dtype=np.float64).reshape(-1, 2)
+    if segments is None:
+        segments = segments_from_polygon(map_polygon)
+    if candidate_positions is None:
+        router_points = points
+        point_count = len(router_coverages)
+    else:
+        router_points = np.asarray(candidate_positions,
+                                   dtype=np.float64).reshape(-1, 2)
+        point_count = links.shape[1]
+    context = (points, point_count, segments, links, MAX_RADIUS, router_points)
 
     router_indices = np.nonzero(router_coverages)[0]
 
-    for router_index in router_indices:
-        for i in range(len(router_positions)):
-            d = distance(router_positions[router_index], router_positions[i])
-            d = max(d, SIGNAL_DISTANCE_CUTOFF)
-
-            if d > MAX_RADIUS and i < point_count:
-                continue
-
-            if(i < point_count):
-                intersecting_walls = check_line_of_sight(router_positions[router_index], router_positions[i], map_polygon)
-            if(i >= point_count):
-                intersecting_walls = check_line_of_sight(router_positions[router_index], router_positions[i], map_polygon)
-                if len(intersecting_walls) > 0:
-                    intersecting_walls.pop()
-
-            strength = -path_loss(d, intersecting_walls)
-
-            if(strength > result[i]):
-                result[i] = strength
+    if workers > 1 and len(router_indices) > 1:
+        chunks = np.array_split(router_indices,
+                                min(workers, len(router_indices)))
+
+        # The geometry is sent once to every worker, not with every chunk
+        with ProcessPoolExecutor(max_workers=len(chunks),
+                                 initializer=_init_intensity_worker,
+                                 initargs=context) as pool:
+            return np.max(list(pool.map(_router_intensity, chunks)), axis=0)
+
+    return _router_intensity(router_indices, _intensity_context(*context))
+
+def _intensity_context(points, point_count, segments, links, max_radius,
+                       router_points):
+    return {
+        'points': points,
+        'router_points': router_points,
+        'point_count': point_count,
+        'segments': segments,
+        'wall_index': wall_tree(segments),
+        'links': links,
+        'max_radius': max_radius,
+    }
+
+def _init_intensity_worker(*context):
+    _worker_state.update(_intensity_context(*context))
+
+def _router_intensity(router_indices, context=None):
+    if context is None:
+        context = _worker_state
+
+    points = context['points']
+    point_count = context['point_count']
+    links = context['links']
+
+    result = np.full(len(points), -np.inf)
+
+    if links is not None:
+        # The signal at the solver points was found while solving
+        targets = np.arange(point_count, len(points))
+        row_lengths = np.diff(links.indptr)
+        pairs_per_router = len(targets) + row_lengths.max(initial=0)
+    else:
+        targets = np.arange(len(points))
+        pairs_per_router = len(targets)
+
+    # Routers are handled a few at a time to bound memory. Walls are only
+    # counted for routers in range, and for the extra points on the
+    # boundary, which have no range, only for far routers that can still
+    # beat the best signal found nearby even through no walls.
+    routers_per_chunk = max(1, INTENSITY_CHUNK_SIZE //
+                            max(pairs_per_router, 1))
+    chunks = [router_indices[start:start + routers_per_chunk]
+              for start in range(0, len(router_indices), routers_per_chunk)]
+
+    for routers in chunks:
+        if links is not None:
+            _max_into(result, *_linked_signal(routers, links))
+
+        _max_into(result, *_pair_signal(routers, targets, context))
+
+    extra = np.arange(point_count, len(points))
+    for routers in chunks:
+        _max_into(result, *_pair_signal(routers, extra, context, result))
 
     return result
 
-def create_intensity_map(router_coverages, intensities, router_positions, room_polygon, all_holes):
-    # Clear plot
-    plt.clf()
-
-    router_position_xs, router_position_ys = zip(*[(point.x, point.y) for point in router_positions])
-
-    room_boundaries = []
-    room_path_codes = []
-
+def _linked_signal(routers, links):
+    """
+    Returns the solver points linked to every router and the signal there
+    """
+    starts = links.indptr[routers]
+    lengths = links.indptr[routers + 1] - starts
+    offsets = np.cumsum(lengths) - lengths
+    linked = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+    return (links.indices[linked],
+            _signal(links.distances[linked], links.walls[linked]))
+
+def _pair_signal(routers, targets, context, nearby=None):
+    """
+    Returns the points reached by every router and the signal there. When
+    the signal nearby each point is given, only the routers out of range
+    that could beat it are evaluated.
+    """
+    points = context['points']
+    router_points = context['router_points']
+    is_extra = targets >= context['point_count']
+
+    router = np.repeat(routers, len(targets))
+    target = np.tile(targets, len(routers))
+    extra = np.tile(is_extra, len(routers))
+
+    d = np.hypot(points[target, 0] - router_points[router, 0],
+                 points[target, 1] - router_points[router, 1])
+    if nearby is None:
+        keep = d <= context['max_radius']
+    else:
+        keep = ((d > context['max_radius']) &
+                (_signal(d, 0) > nearby[target]))
+    router, target, extra, d = (router[keep], target[keep], extra[keep],
+                                d[keep])
+
+    intersecting_walls = count_crossings(router_points[router],
+                                         points[target], context['segments'],
+                                         context['wall_index'])
+
+    # Extra points lie on the boundary, so don't count their own wall
+    intersecting_walls[extra & (intersecting_walls > 0)] -= 1
+
+    return target, _signal(d, intersecting_walls)
+
+def _signal(d, intersecting_walls):
+    d = np.maximum(d, SIGNAL_DISTANCE_CUTOFF)
+    return -propagation_loss(d, concrete=intersecting_walls)
+
+def _max_into(result, indices, values):
+    """
+    Raises result at indices to values, the largest value of repeated
+    indices wins
+    """
+    if len(indices) == 0:
+        return
+
+    order = np.lexsort((values, indices))
+    indices, values = indices[order], values[order]
+    last = np.append(indices[1:] != indices[:-1], True)
+
+    result[indices[last]] = np.maximum(result[indices[last]], values[last])
+
+def create_intensity_map(router_points, intensity_grid, grid_origin,
+                         grid_resolution, room_polygon, all_holes):
+    """
+    Draws the intensity field clipped to the rooms, with axes and a colour
+    bar, on a new Pillow Image. intensity_grid holds the field at the grid
+    points from grid_origin, with -inf outside of the rooms. The field is
+    rasterized with NumPy, laying out a matplotlib figure took several times
+    longer than the whole drawing does now.
+    """
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', IMAGE_SIZE, 'white')
+    draw = ImageDraw.Draw(image)
+
+    field = _spread_into_walls(intensity_grid)
+    finite = field[np.isfinite(field)]
+    low, high = finite.min(initial=0.0), finite.max(initial=0.0)
+    palette = _palette()
+
+    # The field, sampled at the centre of every pixel of the map box
+    left, top, right, bottom = MAP_BOX
+    width, height = right - left, bottom - top
+    x0, y0, x1, y1 = room_polygon.bounds
+    margin = MAP_MARGIN * max(x1 - x0, y1 - y0)
+    bounds = x0, y0, x1, y1 = (x0 - margin, y0 - margin,
+                               x1 + margin, y1 + margin)
+    xs = x0 + (np.arange(width) + 0.5) * (x1 - x0) / width
+    ys = y1 - (np.arange(height) + 0.5) * (y1 - y0) / height
+    values = _sample_grid(field, grid_origin, grid_resolution, xs, ys)
+
+    inside = _room_mask(room_polygon, bounds, width, height) & np.isfinite(values)
+    pixels = np.full((height, width, 3), 255, dtype=np.uint8)
+    pixels[inside] = palette[_palette_index(values[inside], low, high)]
+    image.paste(Image.fromarray(pixels), (left, top))
+
+    # Room exteriors and holes, then the routers on top
+    to_pixels = lambda coords: _to_pixels(coords, bounds, MAP_BOX)
     for geom in room_polygon.geoms:
-        room_boundary = []
-        room_xs, room_ys = geom.exterior.xy
-        for i in range(len(room_xs)):
-            room_boundary.append((room_xs[i], room_ys[i]))
-
-        room_boundaries.append(room_boundary)
-
-    # create path codes for each room
-    for room_boundary in room_boundaries:
-        codes = [mpath.Path.MOVETO] + (len(room_boundary) - 2) * [mpath.Path.LINETO] + [mpath.Path.CLOSEPOLY]
-        room_path_codes.append(codes)
-
-    plt.xlabel('x (m)', fontsize=14)
-    plt.ylabel('y (m)', fontsize=14)
-
-    axes = plt.gca()
-
-    color_map = plt.tricontourf(np.array(router_position_xs, dtype="float64"), np.array(router_position_ys, dtype="float64"), np.array(intensities, dtype="float64"))
-    colorbar = plt.colorbar()
-    colorbar.ax.set_title('Signal loss (dBm)', fontsize=14)
-
-    # Plot router positions
-    for i in range(len(router_coverages)):
-        if(router_coverages[i] == 1):
-            plt.plot(router_positions[i].x, router_positions[i].y, marker="o", markerfacecolor="cyan", markeredgecolor="black")
-
-    flat_room_boundaries = [point for boundary in room_boundaries for point in boundary]
-    flat_room_path_codes = [code for path_codes in room_path_codes for code in path_codes]
-
-    # Clip outside of rooms
-    all_rooms_patch = mpatches.PathPatch(mpath.Path(flat_room_boundaries, flat_room_path_codes), edgecolor='k', transform=axes.transData)
-    for map_element in color_map.collections:
-        map_element.set_clip_path(all_rooms_patch)
-
-    # Plot room exteriors
-    for geom in room_polygon.geoms:
-        room_xs, room_ys = geom.exterior.xy
-        plt.plot(room_xs, room_ys, color="red", alpha=0.7)
-
-    # Clip room holes
+        draw.line(to_pixels(geom.exterior.coords), fill=(255, 77, 77),
+                  width=2)
     for hole in all_holes:
-        hole_xs = [point.x for point in hole]
-        hole_ys = [point.y for point in hole]
-        plt.fill(hole_xs, hole_ys, facecolor="white", edgecolor="red")
+        draw.line(to_pixels(getattr(hole, 'coords', hole)), fill='red',
+                  width=2)
+    for x, y in to_pixels(np.asarray(router_points).reshape(-1, 2)):
+        draw.ellipse((x - 4, y - 4, x + 4, y + 4), fill='cyan',
+                     outline='black')
+
+    _draw_axes(image, draw, bounds)
+    _draw_colorbar(image, draw, palette, low, high)
+
+    return image
+
+# Layout of the intensity map, boxes are (left, top, right, bottom) pixels
+IMAGE_SIZE = (640, 480)
+MAP_BOX = (80, 58, 480, 427)
+# Space around the rooms, as a fraction of their larger side
+MAP_MARGIN = 0.02
+COLORBAR_BOX = (505, 58, 523, 427)
+TICK_LENGTH = 4
+TICK_FONT_SIZE = 14
+LABEL_FONT_SIZE = 19
+
+# Fonts and colour map of the intensity map, loaded with the first drawing
+_drawing_state = {}
+
+def _font(size):
+    from PIL import ImageFont
+
+    key = ('font', size)
+    if key not in _drawing_state:
+        import matplotlib
+        path = os.path.join(matplotlib.get_data_path(), 'fonts', 'ttf',
+                            'DejaVuSans.ttf')
+        _drawing_state[key] = ImageFont.truetype(path, size)
+    return _drawing_state[key]
+
+def _palette():
+    if 'palette' not in _drawing_state:
+        from matplotlib import colormaps
+        _drawing_state['palette'] = colormaps['viridis'](
+                np.linspace(0, 1, 256), bytes=True)[:, :3]
+    return _drawing_state['palette']
+
+def _palette_index(values, low, high):
+    scale = 255 / (high - low) if high > low else 0
+    return np.clip(np.rint((values - low) * scale), 0, 255).astype(np.intp)
+
+def _to_pixels(coords, bounds, box):
+    """
+    Returns the image pixels of map coordinates when bounds fills box, as
+    a list of (x, y) the way ImageDraw takes them
+    """
+    x0, y0, x1, y1 = bounds
+    left, top, right, bottom = box
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    xs = left + (coords[:, 0] - x0) * (right - left) / (x1 - x0)
+    ys = top + (y1 - coords[:, 1]) * (bottom - top) / (y1 - y0)
+    return list(zip(xs.tolist(), ys.tolist()))
+
+def _ticks(low, high, count=6):
+    """
+    Returns round values from low to high, about count of them
+    """
+    if not high > low:
+        return np.array([low])
+
+    step = (high - low) / count
+    magnitude = 10.0 ** np.floor(np.log10(step))
+    step = magnitude * min(s for s in (1, 2, 2.5, 5, 10)
+                           if s * magnitude >= step)
+    return np.arange(np.ceil(low / step), np.floor(high / step) + 1) * step
+
+def _tick_label(value):
+    # + 0.0 turns -0.0 into 0.0
+    return f'{np.round(value, 6) + 0.0:g}'
+
+def _draw_axes(image, draw, bounds):
+    from PIL import Image, ImageDraw
+
+    x0, y0, x1, y1 = bounds
+    left, top, right, bottom = MAP_BOX
+    tick_font = _font(TICK_FONT_SIZE)
+    label_font = _font(LABEL_FONT_SIZE)
+
+    draw.rectangle(MAP_BOX, outline='black')
+    for x, _ in _to_pixels([(x, y0) for x in _ticks(x0, x1)], bounds,
+                           MAP_BOX):
+        value = x0 + (x - left) * (x1 - x0) / (right - left)
+        draw.line((x, bottom, x, bottom + TICK_LENGTH), fill='black')
+        draw.text((x, bottom + TICK_LENGTH + 2), _tick_label(value),
+                  fill='black', font=tick_font, anchor='mt')
+    for _, y in _to_pixels([(x0, y) for y in _ticks(y0, y1)], bounds,
+                           MAP_BOX):
+        value = y1 - (y - top) * (y1 - y0) / (bottom - top)
+        draw.line((left - TICK_LENGTH, y, left, y), fill='black')
+        draw.text((left - TICK_LENGTH - 3, y), _tick_label(value),
+                  fill='black', font=tick_font, anchor='rm')
+
+    draw.text(((left + right) / 2, bottom + 28), 'x (m)', fill='black',
+              font=label_font, anchor='mt')
+
+    # Pillow draws no vertical text, so the y label is drawn on its own
+    # and turned
+    box = draw.textbbox((0, 0), 'y (m)', font=label_font)
+    label = Image.new('L', (box[2], box[3]))
+    ImageDraw.Draw(label).text((0, 0), 'y (m)', fill=255, font=label_font)
+    label = label.rotate(90, expand=True)
+    image.paste('black', (left - 68, (top + bottom - label.height) // 2),
+                label)
+
+def _draw_colorbar(image, draw, palette, low, high):
+    from PIL import Image
+
+    left, top, right, bottom = COLORBAR_BOX
+    tick_font = _font(TICK_FONT_SIZE)
+
+    rows = palette[np.linspace(255, 0, bottom - top).round().astype(np.intp)]
+    strip = np.repeat(rows[:, None], right - left, axis=1)
+    image.paste(Image.fromarray(np.ascontiguousarray(strip)), (left, top))
+    draw.rectangle(COLORBAR_BOX, outline='black')
+
+    for value in _ticks(low, high):
+        fraction = (value - low) / (high - low) if high > low else 0.5
+        y = bottom - fraction * (bottom - top)
+        draw.line((right, y, right + TICK_LENGTH, y), fill='black')
+        draw.text((right + TICK_LENGTH + 3, y), _tick_label(value),
+                  fill='black', font=tick_font, anchor='lm')
+
+    draw.text(((left + right) / 2, top - 10), 'Signal loss (dBm)',
+              fill='black', font=_font(LABEL_FONT_SIZE), anchor='md')
+
+def _spread_into_walls(grid, steps=2):
+    """
+    Returns grid with its -inf cells set to the largest of their finite
+    neighbours, repeated steps times. Cells cut by a wall have their centre
+    outside of the rooms, this lets the field reach up to the walls.
+    """
+    grid = np.array(grid, dtype=np.float64)
+    rows, columns = grid.shape
+    for _ in range(steps):
+        padded = np.pad(grid, 1, constant_values=-np.inf)
+        neighbours = np.max([padded[i:i + rows, j:j + columns]
+                             for i in range(3) for j in range(3)], axis=0)
+        grid = np.where(np.isfinite(grid), grid, neighbours)
+
+    return grid
+
+def _sample_grid(grid, grid_origin, grid_resolution, xs, ys):
+    """
+    Returns the bilinear interpolation of grid at every (ys[i], xs[j]), nan
+    where it runs into cells without a value
+    """
+    def weights(positions, origin, count):
+        index = np.clip((positions - origin) / grid_resolution, 0, count - 1)
+        low = np.minimum(np.floor(index).astype(np.int64), max(count - 2, 0))
+        high = np.minimum(low + 1, count - 1)
+        return low, high, index - low
+
+    rows, columns = grid.shape
+    r0, r1, v = weights(ys, grid_origin[1], rows)
+    c0, c1, u = weights(xs, grid_origin[0], columns)
+
+    with np.errstate(invalid='ignore'):
+        low = grid[r0][:, c0] * (1 - u) + grid[r0][:, c1] * u
+        high = grid[r1][:, c0] * (1 - u) + grid[r1][:, c1] * u
+        values = low * (1 - v[:, None]) + high * v[:, None]
+
+    return np.where(np.isfinite(values), values, np.nan)
+
+def _room_mask(room_polygon, bounds, width, height):
+    """
+    Returns which pixels of a width x height image over bounds lie inside
+    the rooms, with the first row at the top
+    """
+    from PIL import Image, ImageDraw
+
+    box = (0, 0, width, height)
+    mask = Image.new('1', (width, height))
+    draw = ImageDraw.Draw(mask)
+    for geom in room_polygon.geoms:
+        draw.polygon(_to_pixels(geom.exterior.coords, bounds, box), fill=1)
+    for geom in room_polygon.geoms:
+        for hole in geom.interiors:
+            draw.polygon(_to_pixels(hole.coords, bounds, box), fill=0)
 
-    return plt.gcf()
+    return np.asarray(mask, dtype=bool)
 
 def show_room_map(room_map, x0, y0, x1, y1, grid_resolution):
-    fig, ax = plt.subplots()
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.subplots()
 
     half_res = grid_resolution / 2.0
 
@@ -109,12 +421,36 @@ def show_room_map(room_map, x0, y0, x1, y1, grid_resolution):
 
     ax.grid(which='both')
 
+    rings = []
     for geom in room_map.polygon.geoms:
-        xe, ye = geom.exterior.xy
-        plt.plot(xe, ye, color="red")
-
-        for interior in geom.interiors:
-            xi, yi = zip(*interior.coords[:])
-            plt.plot(xi, yi, color="red")
-
-    return plt.gcf()
+        rings.append(geom.exterior)
+        rings.extend(geom.interiors)
+
+    ax.plot(*separated_rings(rings), color="red")
+
+    return fig
+
+def figure_to_png(fig):
+    """
+    Returns the PNG of a matplotlib Figure or of a Pillow Image
+    """
+    buf = io.BytesIO()
+    if hasattr(fig, 'savefig'):
+        fig.savefig(buf, format='png')
+    else:
+        fig.save(buf, format='png', compress_level=PNG_COMPRESS_LEVEL)
+    return buf.getvalue()
+
+def separated_rings(rings):
+    """
+    Joins rings into one line separated by nan, so they can be drawn as a
+    single artist
+    """
+    xs = []
+    ys = []
+    for ring in rings:
+        coords = np.asarray(ring.coords)
+        xs.extend([coords[:, 0], [np.nan]])
+        ys.extend([coords[:, 1], [np.nan]])
+
+    return np.concatenate(xs), np.concatenate(ys)
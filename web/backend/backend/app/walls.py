@@ -0,0 +1,189 @@
+import numpy as np
+import shapely
+
+WALL_TOLERANCE = 0.20
+
+# Intersections closer than this along a sight line are the same wall joint
+JOINT_TOLERANCE = 1e-9
+
+# Hits this close to the end of a line or wall, in parts of its length, and
+# lines this close to parallel with a wall are left to GEOS, so they are
+# decided exactly like shapely's intersection does
+EDGE_TOLERANCE = 1e-6
+
+# Upper bound on line/wall combinations tested at once
+CHUNK_SIZE = 2**18
+
+# Lines looked up in a wall_tree at once, until the walls per line are known
+TREE_BLOCK = 2**12
+
+# shapely geometry type id of a Point
+POINT = 0
+
+def segments_from_polygon(polygon):
+    """
+    Returns the walls of polygon as an (m, 4) array of x0, y0, x1, y1
+    """
+    rings = shapely.get_parts(polygon.boundary)
+    coords, index = shapely.get_coordinates(rings, return_index=True)
+
+    same_ring = index[1:] == index[:-1]
+    segments = np.hstack([coords[:-1][same_ring], coords[1:][same_ring]])
+
+    # Repeated vertices give zero length walls
+    nonzero = np.any(segments[:, :2] != segments[:, 2:], axis=1)
+    return segments[nonzero]
+
+def wall_tree(segments):
+    """
+    Returns a spatial index over the given walls
+    """
+    return shapely.STRtree(shapely.linestrings(segments.reshape(-1, 2, 2)))
+
+def count_crossings(starts, ends, segments, tree=None):
+    """
+    Returns the number of walls crossed by each line from starts[i] to ends[i].
+    Crossings closer than WALL_TOLERANCE to each other are counted as one wall,
+    and lines running along a wall cross none.
+    When a wall_tree is given, each line is only tested against the walls
+    touching its bounding box. A wall outside it cannot be hit, so the
+    counts are the same as without the tree.
+    """
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+    starts, ends = np.broadcast_arrays(starts, ends)
+    line_count = len(starts)
+    segment_count = len(segments)
+
+    if line_count == 0 or segment_count == 0:
+        return np.zeros(line_count, dtype=np.int64)
+
+    hit_lines = []
+    hit_positions = []
+    overlapping = []
+
+    if tree is None:
+        block = max(1, CHUNK_SIZE // segment_count)
+    else:
+        block = TREE_BLOCK
+
+    start = 0
+    while start < line_count:
+        stop = min(start + block, line_count)
+
+        if tree is None:
+            line_index = np.repeat(np.arange(start, stop), segment_count)
+            segment_index = np.tile(np.arange(segment_count), stop - start)
+        else:
+            lines = shapely.linestrings(
+                np.stack([starts[start:stop], ends[start:stop]], axis=1))
+            line_index, segment_index = tree.query(lines)
+            line_index = line_index + start
+
+            # Long lines touch many more walls than short ones, so the next
+            # block is sized by the walls per line seen in this one
+            block = max(1, CHUNK_SIZE * (stop - start) //
+                        max(len(line_index), 1))
+
+        for first in range(0, len(line_index), CHUNK_SIZE):
+            pairs = slice(first, first + CHUNK_SIZE)
+            lines, positions, overlaps = _intersect(starts, ends, segments,
+                                                    line_index[pairs],
+                                                    segment_index[pairs])
+            hit_lines.append(lines)
+            hit_positions.append(positions)
+            overlapping.append(overlaps)
+
+        start = stop
+
+    if len(hit_lines) == 0:
+        return np.zeros(line_count, dtype=np.int64)
+
+    return _count_walls(np.concatenate(hit_lines),
+                        np.concatenate(hit_positions), line_count,
+                        np.concatenate(overlapping))
+
+def _intersect(starts, ends, segments, line_index, segment_index):
+    """
+    Tests the given line/wall combinations for intersection. Returns the
+    line index of every hit and its distance from the start of the line,
+    and the index of every line running along a wall.
+    """
+    p = starts[line_index]
+    r = ends[line_index] - p
+    q = segments[segment_index, :2]
+    s = segments[segment_index, 2:] - q
+    qp = q - p
+
+    denom = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (qp[:, 0] * s[:, 1] - qp[:, 1] * s[:, 0]) / denom
+        u = (qp[:, 0] * r[:, 1] - qp[:, 1] * r[:, 0]) / denom
+
+    r_length = np.hypot(r[:, 0], r[:, 1])
+    s_length = np.hypot(s[:, 0], s[:, 1])
+    parallel = np.abs(denom) <= EDGE_TOLERANCE * r_length * s_length
+
+    # Parallel lines only meet a wall they are in line with
+    offset = np.abs(qp[:, 0] * r[:, 1] - qp[:, 1] * r[:, 0])
+    in_line = parallel & (offset <= EDGE_TOLERANCE * r_length *
+                          (r_length + s_length))
+
+    # Parallel walls give nan or huge t and u, and are handled above
+    low, high = EDGE_TOLERANCE, 1.0 - EDGE_TOLERANCE
+    hit = ~parallel & (t > low) & (t < high) & (u > low) & (u < high)
+    near = ~parallel & ~hit & (t > -low) & (t < 1.0 + low) & \
+        (u > -low) & (u < 1.0 + low)
+
+    lines = [line_index[hit]]
+    positions = [t[hit] * r_length[hit]]
+
+    unsure = np.flatnonzero(near | in_line)
+    overlaps = line_index[:0]
+    if len(unsure) > 0:
+        sight = shapely.linestrings(
+            np.stack([p[unsure], ends[line_index[unsure]]], axis=1))
+        wall = shapely.linestrings(
+            segments[segment_index[unsure]].reshape(-1, 2, 2))
+        crossing = shapely.intersection(sight, wall)
+
+        point = shapely.get_type_id(crossing) == POINT
+        xy = shapely.get_coordinates(crossing[point])
+        lines.append(line_index[unsure[point]])
+        positions.append(np.hypot(*(xy - p[unsure[point]]).T))
+
+        overlaps = line_index[unsure[~point & ~shapely.is_empty(crossing)]]
+
+    return np.concatenate(lines), np.concatenate(positions), overlaps
+
+def _count_walls(lines, positions, line_count, overlapping):
+    if len(lines) == 0:
+        return np.zeros(line_count, dtype=np.int64)
+
+    order = np.lexsort((positions, lines))
+    lines = lines[order]
+    positions = positions[order]
+
+    # Walls meeting in a joint give one intersection point
+    distinct = np.ones(len(lines), dtype=bool)
+    distinct[1:] = ((lines[1:] != lines[:-1]) |
+                    (positions[1:] - positions[:-1] > JOINT_TOLERANCE))
+    lines = lines[distinct]
+    positions = positions[distinct]
+
+    # All points lie on the same line, so their distance is the difference
+    # in position. Every pair of points closer than WALL_TOLERANCE removes
+    # one wall.
+    stride = positions.max() + 2 * WALL_TOLERANCE + 1.0
+    keys = lines * stride + positions
+    close_after = (np.searchsorted(keys, keys + WALL_TOLERANCE, side='left') -
+                   np.arange(len(keys)) - 1)
+
+    counts = (np.bincount(lines, minlength=line_count) -
+              np.bincount(lines, weights=close_after, minlength=line_count))
+
+    # The intersection of a line running along a wall is not made of points
+    # only, and such lines have always been counted as crossing no walls
+    counts[overlapping] = 0
+
+    return np.maximum(counts, 0).astype(np.int64)
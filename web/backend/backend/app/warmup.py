@@ -0,0 +1,55 @@
+"""
+Work that would otherwise slow down the first requests of a fresh worker
+"""
+import logging
+
+import numpy as np
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+def warm_up():
+    """
+    Loads the modules that are otherwise loaded on first use, builds the
+    font cache and solves a tiny floor, so the first request of the worker
+    is as fast as the ones after it. Returns the seconds it took, which are
+    also recorded under the 'warmup' endpoint of the metrics.
+    """
+    with metrics.tracing('warmup') as trace:
+        with metrics.stage('imports'):
+            import matplotlib.figure
+            import requests
+            import scipy.optimize
+            import scipy.spatial
+
+        with metrics.stage('milp'):
+            scipy.optimize.milp(c=np.ones(1), integrality=np.ones(1),
+                                bounds=scipy.optimize.Bounds(1, 1))
+
+        # Drawing the map loads the fonts of the axis labels. The room map is
+        # built here, so the tiny floor stays out of the geometry store.
+        with metrics.stage('pipeline'):
+            from .map_gen import (RoomMap, plan_room_map,
+                                  render_router_coverage)
+            from .viz import figure_to_png
+
+            plan = plan_room_map(RoomMap(_tiny_floor()), 1.0, 75.0)
+            figure_to_png(render_router_coverage(plan))
+
+    seconds = trace.stages['total']
+    logger.info('Warm-up took %.2fs', seconds)
+    return seconds
+
+def _tiny_floor():
+    from .map_gen import Coordinate, Room, points_to_coordinates
+
+    origin = Coordinate(10.4035, 63.4155)
+    rooms = []
+    for x0 in (0.0, 4.0):
+        outline = np.array([(x0, 0), (x0 + 4, 0), (x0 + 4, 4), (x0, 4),
+                            (x0, 0)], dtype=np.float64)
+        coordinates = points_to_coordinates(origin, outline)
+        rooms.append(Room(origin, coordinates, []))
+
+    return rooms
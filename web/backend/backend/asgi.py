@@ -9,8 +9,21 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+if settings.WARM_UP:
+    # Load the views and run the solver once before taking traffic. Servers
+    # may import this module inside their event loop, where Django refuses
+    # synchronous work, so it runs in a thread of its own.
+    import threading
+    import backend.urls
+    from backend.app.warmup import warm_up
+
+    warm_up_thread = threading.Thread(target=warm_up, name='warm-up')
+    warm_up_thread.start()
+    warm_up_thread.join()
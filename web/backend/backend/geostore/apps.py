@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class GeostoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'backend.geostore'
+
+    def ready(self):
+        # Serve room geometry from the store instead of MazeMap
+        from ..app import map_gen
+        from . import store
+
+        map_gen.use_geometry_store(store)
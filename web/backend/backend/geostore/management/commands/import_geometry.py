@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...store import import_building, import_pois, save_pois
+from ....app import mazemap
+from ....app.map_gen import fetch_building, get_room_map_for
+
+
+class Command(BaseCommand):
+    help = ('Imports MazeMap POIs into the geometry store, from MazeMap or '
+            'from JSON files of whole buildings like {"pois": [...]}')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--building', type=int, nargs='+', default=[],
+                            help='buildings to fetch from MazeMap')
+        parser.add_argument('--poid', type=int, nargs='+', default=[],
+                            help='single POIs to fetch from MazeMap')
+        parser.add_argument('--file', nargs='+', default=[],
+                            help='JSON files of POIs to import')
+        parser.add_argument('--room-maps', action='store_true',
+                            help='also build and store the room map of '
+                                 'every floor of the imported buildings')
+
+    def handle(self, *args, **options):
+        buildings = set(options['building'])
+
+        for building_id in options['building']:
+            pois = import_building(building_id)
+            self.stdout.write(f'Building {building_id}: {len(pois)} POIs')
+
+        for path in options['file']:
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Could not read {path}: {e}')
+
+            pois = data['pois'] if isinstance(data, dict) else data
+            import_pois(pois)
+            buildings.update(int(p['buildingId']) for p in pois
+                             if p.get('buildingId') is not None)
+            self.stdout.write(f'{path}: {len(pois)} POIs')
+
+        if options['poid']:
+            found = [p for p in mazemap.fetch_pois(options['poid'])
+                     if p is not None]
+            save_pois(found)
+            self.stdout.write(f'{len(found)} of {len(options["poid"])} POIs')
+
+        if options['room_maps']:
+            for building_id in sorted(buildings):
+                floors = fetch_building(building_id)
+                for rooms in floors.values():
+                    get_room_map_for(rooms)
+                self.stdout.write(f'Building {building_id}: '
+                                  f'{len(floors)} room maps')
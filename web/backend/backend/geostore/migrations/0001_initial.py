@@ -0,0 +1,44 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Building',
+            fields=[
+                ('building_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Poi',
+            fields=[
+                ('poid', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('building_id', models.BigIntegerField(null=True)),
+                ('z', models.IntegerField(null=True)),
+                ('identifier', models.CharField(blank=True, max_length=255, null=True)),
+                ('data', models.JSONField()),
+                ('fetched_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StoredRoomMap',
+            fields=[
+                ('key', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='poi',
+            index=models.Index(fields=['building_id', 'z'], name='geostore_po_buildin_2f3c63_idx'),
+        ),
+    ]
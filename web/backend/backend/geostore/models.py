@@ -0,0 +1,34 @@
+from django.db import models
+
+
+class Poi(models.Model):
+    """
+    Raw MazeMap POI JSON, as returned by the POI API
+    """
+    poid = models.BigIntegerField(primary_key=True)
+    building_id = models.BigIntegerField(null=True)
+    z = models.IntegerField(null=True)
+    identifier = models.CharField(max_length=255, blank=True, null=True)
+    data = models.JSONField()
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['building_id', 'z'])]
+
+
+class Building(models.Model):
+    """
+    When every POI of a building was last imported
+    """
+    building_id = models.BigIntegerField(primary_key=True)
+    fetched_at = models.DateTimeField()
+
+
+class StoredRoomMap(models.Model):
+    """
+    Projected and merged room rings with their wall segments, stored with
+    RoomMap.to_bytes under the key used by get_room_map_for
+    """
+    key = models.CharField(max_length=255, primary_key=True)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,132 @@
+"""
+Local store of MazeMap geometry. POIs are fetched from MazeMap only when
+they are missing or older than GEOSTORE_TTL seconds, and never when
+GEOSTORE_OFFLINE is set. Stale POIs are served when MazeMap can not be
+reached.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..app import mazemap
+from .models import Building, Poi, StoredRoomMap
+
+def is_fresh(fetched_at):
+    if settings.GEOSTORE_TTL is None:
+        return True
+
+    return timezone.now() - fetched_at < timedelta(
+            seconds=settings.GEOSTORE_TTL)
+
+def fetch_poi(poid):
+    return fetch_pois([poid])[0]
+
+def fetch_pois(poids):
+    """
+    Returns the POIs in the order of poids, with None for POIs that were not
+    found
+    """
+    poids = [int(poid) for poid in poids]
+    stored = {p.poid: p for p in Poi.objects.filter(poid__in=poids)}
+    pois = {poid: p.data for poid, p in stored.items()}
+
+    import requests
+
+    refresh = [poid for poid in dict.fromkeys(poids)
+               if poid not in stored or not is_fresh(stored[poid].fetched_at)]
+    if refresh and not settings.GEOSTORE_OFFLINE:
+        try:
+            fetched = [p for p in mazemap.fetch_pois(refresh) if p is not None]
+        except requests.RequestException:
+            if any(poid not in stored for poid in refresh):
+                raise
+            fetched = []
+
+        save_pois(fetched)
+        pois.update((int(p['poiId']), p) for p in fetched)
+
+    return [pois.get(poid) for poid in poids]
+
+def fetch_building_pois(building_id):
+    """
+    Returns every POI in the building, importing the building again when it
+    was never imported or has gone stale
+    """
+    import requests
+
+    building = Building.objects.filter(building_id=building_id).first()
+    if not settings.GEOSTORE_OFFLINE and (
+            building is None or not is_fresh(building.fetched_at)):
+        try:
+            return import_building(building_id)
+        except requests.RequestException:
+            if building is None:
+                raise
+
+    return [p.data for p in
+            Poi.objects.filter(building_id=building_id).order_by('poid')]
+
+def import_building(building_id):
+    """
+    Fetches every POI of the building from MazeMap and replaces the stored
+    ones. Returns the POIs. A page MazeMap fails to return raises before
+    anything is stored, so a partial building never replaces a whole one.
+    """
+    pois = mazemap.fetch_building_pois(building_id, strict=True)
+    import_pois(pois, building_id)
+
+    return pois
+
+def import_pois(pois, building_id=None):
+    """
+    Stores POIs that make up whole buildings. The buildings are marked as
+    imported, and their stored POIs missing from pois are removed.
+    """
+    buildings = {_building_of(p, building_id) for p in pois} - {None}
+    if building_id is not None:
+        buildings.add(building_id)
+
+    now = timezone.now()
+    with transaction.atomic():
+        Poi.objects.filter(building_id__in=buildings).exclude(
+                poid__in=[int(p['poiId']) for p in pois]).delete()
+        save_pois(pois, building_id, now)
+
+        Building.objects.bulk_create(
+                [Building(building_id=b, fetched_at=now) for b in buildings],
+                update_conflicts=True, unique_fields=['building_id'],
+                update_fields=['fetched_at'])
+
+def save_pois(pois, building_id=None, fetched_at=None):
+    fetched_at = fetched_at or timezone.now()
+    Poi.objects.bulk_create(
+            [Poi(poid=int(p['poiId']), building_id=_building_of(p, building_id),
+                 z=p.get('z'), identifier=p.get('identifier'), data=p,
+                 fetched_at=fetched_at)
+             for p in pois],
+            update_conflicts=True, unique_fields=['poid'],
+            update_fields=['building_id', 'z', 'identifier', 'data',
+                           'fetched_at'])
+
+def load_room_map(key):
+    record = StoredRoomMap.objects.filter(key=key).first()
+    if record is None:
+        return None
+
+    return bytes(record.data)
+
+def save_room_map(key, data):
+    """
+    Stores a room map, dropping the oldest ones beyond GEOSTORE_ROOM_MAPS
+    """
+    StoredRoomMap.objects.update_or_create(key=key, defaults={'data': data})
+
+    oldest = StoredRoomMap.objects.order_by('-created_at').values_list(
+            'key', flat=True)[settings.GEOSTORE_ROOM_MAPS:]
+    StoredRoomMap.objects.filter(key__in=list(oldest)).delete()
+
+def _building_of(poi, building_id=None):
+    b = poi.get('buildingId', building_id)
+    return None if b is None else int(b)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,7 +39,8 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'corsheaders'
+    'corsheaders',
+    'backend.geostore',
 ]
 
 MIDDLEWARE = [
@@ -128,3 +130,38 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8000"
 ]
+
+# Solves running at once in the compute pool, how many more may wait for a
+# worker before requests are refused with 503, and the Retry-After sent then
+COMPUTE_WORKERS = 2
+COMPUTE_QUEUE = 8
+COMPUTE_RETRY_AFTER = 5
+
+# Load the views and run a tiny solve when a worker starts, so its first
+# request is not slowed down by imports and font loading
+WARM_UP = True
+
+# Number of processes used to compute coverage and intensity per request
+SOLVER_WORKERS = max(1, (os.cpu_count() or 1) // COMPUTE_WORKERS)
+
+# Computed images are cached in memory, and on disk if a directory is set
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_DIR = None
+RESULT_CACHE_MAX_DISK_BYTES = 1024 * 1024 * 1024
+
+# Background threads running submitted solve jobs, and how many finished
+# jobs are kept around for their results
+JOB_WORKERS = 2
+JOB_HISTORY = 256
+
+# Map sessions whose last solve is kept to speed up re-solving after the
+# selected rooms change
+SESSION_LIMIT = 16
+
+# POIs fetched from MazeMap are kept in the database and fetched again after
+# this many seconds, or never when None. Offline, only stored POIs are used.
+GEOSTORE_TTL = 7 * 24 * 60 * 60
+GEOSTORE_OFFLINE = False
+
+# Room maps kept in the database
+GEOSTORE_ROOM_MAPS = 256
@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from backend.app import mazemap
+
+# Failures the stub answers with before the POI itself
+FLAKY_FAILURES = 2
+
+# Seconds the slow POI takes to answer
+SLOW_SECONDS = 2.0
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the MazeMap API. POI 'flaky' fails with 503 a few times,
+    POI 'slow' answers late, building 2 fails on its second page.
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.server.requests[url.path] += 1
+
+        if url.path == '/api/pois/':
+            self.send_page(int(query['buildingid'][0]),
+                           int(query['fromid'][0]))
+            return
+
+        poid = url.path.rsplit('/', 1)[-1]
+        if poid == 'flaky' and \
+                self.server.requests[url.path] <= FLAKY_FAILURES:
+            self.send_json(503, {})
+        elif poid == 'slow':
+            time.sleep(SLOW_SECONDS)
+            self.send_json(200, {'poiId': poid})
+        elif poid == 'missing':
+            self.send_json(404, {})
+        else:
+            # Answer later POIs first, so the order comes from fetch_pois
+            if poid.isdigit():
+                time.sleep(0.05 / (1 + int(poid)))
+            self.send_json(200, {'poiId': poid})
+
+    def send_page(self, building_id, from_id):
+        if building_id == 2 and from_id > 0:
+            self.send_json(404, {})
+            return
+
+        page = [{'poiId': i} for i in range(from_id, min(from_id + 2, 5))]
+        self.send_json(200, {'pois': page})
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+class MazeMapTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        cls.server.daemon_threads = True
+        cls.server.requests = Counter()
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                                      daemon=True)
+        cls.thread.start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests.clear()
+        self.session = mazemap.create_session(backoff=0)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_retries_unavailable(self):
+        poi = mazemap.fetch_poi('flaky', self.session, self.base_url)
+
+        self.assertEqual(poi, {'poiId': 'flaky'})
+        self.assertEqual(self.server.requests['/api/pois/flaky'],
+                         FLAKY_FAILURES + 1)
+
+    def test_pois_in_order(self):
+        poids = [str(i) for i in range(8)] + ['missing']
+        pois = mazemap.fetch_pois(poids, self.session, self.base_url)
+
+        self.assertEqual(pois, [{'poiId': str(i)} for i in range(8)] + [None])
+
+    def test_timeout(self):
+        # Read timeouts are retried too, and surface as ConnectionError
+        start = time.perf_counter()
+        with mock.patch.object(mazemap, 'TIMEOUT', (1.0, 0.2)):
+            with self.assertRaises(requests.ConnectionError):
+                mazemap.fetch_poi('slow', self.session, self.base_url)
+
+        self.assertLess(time.perf_counter() - start, SLOW_SECONDS)
+        self.assertEqual(self.server.requests['/api/pois/slow'],
+                         mazemap.RETRIES + 1)
+
+    def test_building_pages(self):
+        pois = mazemap.fetch_building_pois(1, self.session, self.base_url,
+                                           strict=True)
+
+        self.assertEqual([poi['poiId'] for poi in pois], list(range(5)))
+
+    def test_strict_failed_page(self):
+        pois = mazemap.fetch_building_pois(2, self.session, self.base_url)
+        self.assertEqual([poi['poiId'] for poi in pois], [0, 1])
+
+        with self.assertRaises(requests.HTTPError):
+            mazemap.fetch_building_pois(2, self.session, self.base_url,
+                                        strict=True)
@@ -0,0 +1,70 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from backend.app.optimization import cover, BOUNDED, EXACT, GREEDY
+
+def smallest_cover(A):
+    """
+    Size of the smallest set of rows covering every column, by trying all
+    of them
+    """
+    rows = len(A)
+    for size in range(rows + 1):
+        for chosen in itertools.combinations(range(rows), size):
+            if A[list(chosen)].any(axis=0).all():
+                return size
+
+def random_matrix(rng, rows, columns, density):
+    """
+    Returns a random 0/1 matrix with at least one row covering every column
+    """
+    A = (rng.random((rows, columns)) < density).astype(np.int8)
+    A[rng.integers(rows, size=columns), np.arange(columns)] = 1
+    return A
+
+class CoverTest(unittest.TestCase):
+    def assert_cover(self, A, result):
+        selection = np.flatnonzero(result.selection)
+        self.assertTrue(A[selection].any(axis=0).all())
+        self.assertLessEqual(result.lower_bound, smallest_cover(A))
+
+    def test_exact_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        for _ in range(60):
+            rows, columns = rng.integers(1, 11), rng.integers(1, 16)
+            A = random_matrix(rng, rows, columns, rng.uniform(0.1, 0.5))
+
+            result = cover(A, EXACT)
+            self.assert_cover(A, result)
+            self.assertEqual(result.size, smallest_cover(A))
+            self.assertEqual(result.gap, 0.0)
+
+    def test_approximations_cover(self):
+        rng = np.random.default_rng(1)
+        for _ in range(30):
+            A = random_matrix(rng, 8, 12, 0.3)
+
+            for mode in (GREEDY, BOUNDED):
+                result = cover(A, mode)
+                self.assert_cover(A, result)
+                self.assertGreaterEqual(result.size, smallest_cover(A))
+
+    def test_all_forced(self):
+        for A in (np.eye(4), np.eye(4)[[2, 0, 3, 1]]):
+            result = cover(A, EXACT)
+
+            self.assertEqual(result.size, 4)
+            self.assertEqual(result.gap, 0.0)
+            np.testing.assert_array_equal(result.selection, np.ones(4))
+
+    def test_duplicate_rows(self):
+        A = np.array([[1, 1, 0, 0],
+                      [1, 1, 0, 0],
+                      [0, 0, 1, 1],
+                      [0, 1, 1, 0]])
+        result = cover(A, EXACT)
+
+        self.assert_cover(A, result)
+        self.assertEqual(result.size, 2)
@@ -0,0 +1,51 @@
+import unittest
+
+import numpy as np
+
+from backend.app import solver
+from backend.app.optimization import GREEDY
+from backend.app.session import CoverageSession
+from benchmarks.floorplans import synthetic_floor
+
+GRID_RESOLUTION = 0.5
+MAX_PATH_LOSS = 75.0
+
+class CoverageSessionTest(unittest.TestCase):
+    def assert_links_match(self, session, plan):
+        """
+        The links the session kept up to date must cover like links found
+        from scratch for the same points
+        """
+        points = plan.positions[:plan.point_count]
+        fresh = solver.find_links(points, plan.room_map.polygon,
+                                  session.max_radius,
+                                  segments=plan.room_map.segments)
+
+        updated = session.links.coverage(MAX_PATH_LOSS)
+        expected = fresh.coverage(MAX_PATH_LOSS)
+        self.assertEqual(updated.shape, expected.shape)
+        self.assertEqual((updated != expected).nnz, 0)
+
+    def test_add_and_remove_rooms(self):
+        # The corridor comes first, then the offices on both sides of it
+        rooms = synthetic_floor(1, 6)
+        corridor, offices = rooms[:1], rooms[1:]
+
+        selections = [
+            corridor + offices[:4],
+            corridor + offices[:8],
+            corridor + offices[2:8],
+            offices[2:8],
+            offices[:3] + offices[9:],
+            rooms,
+            corridor,
+        ]
+
+        session = CoverageSession(GRID_RESOLUTION, MAX_PATH_LOSS)
+        for selection in selections:
+            plan = session.update(selection, GREEDY)
+
+            self.assert_links_match(session, plan)
+            covers = session.links.coverage(MAX_PATH_LOSS)
+            chosen = np.flatnonzero(plan.cover.selection)
+            self.assertTrue(np.all(covers[chosen].sum(axis=0) > 0))
@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+import shapely
+from shapely import LineString
+
+from backend.app import map_gen
+from backend.app.walls import (WALL_TOLERANCE, count_crossings,
+                               segments_from_polygon, wall_tree)
+from benchmarks.floorplans import load_fixture, sized_floor
+
+def shapely_walls(start, end, polygon):
+    """
+    Wall count of the shapely based line of sight check count_crossings
+    replaced
+    """
+    intersection = polygon.boundary.intersection(LineString([start, end]))
+
+    if intersection.geom_type == 'Point':
+        return 1
+    if intersection.geom_type != 'MultiPoint':
+        return 0
+
+    points = list(set(intersection.geoms))
+    count = len(points)
+    for i in range(len(points)):
+        for j in range(i + 1, len(points)):
+            if points[i].distance(points[j]) < WALL_TOLERANCE:
+                count -= 1
+
+    return max(count, 0)
+
+def sight_lines(rooms, grid_resolution, line_count):
+    """
+    Returns the polygon of rooms and random lines between its grid points
+    and the corners of its walls
+    """
+    polygon = map_gen.RoomMap(rooms).polygon
+    grid = map_gen.create_rectangular_grid(*polygon.bounds, grid_resolution)
+    points = np.vstack([grid[map_gen.inside_mask(polygon, grid)],
+                        shapely.get_coordinates(polygon.boundary)])
+
+    rng = np.random.default_rng(0)
+    starts = points[rng.integers(len(points), size=line_count)]
+    ends = points[rng.integers(len(points), size=line_count)]
+
+    return polygon, starts, ends
+
+class CountCrossingsTest(unittest.TestCase):
+    def test_matches_shapely(self):
+        for rooms in (sized_floor('small'), load_fixture('hall_and_wing')):
+            polygon, starts, ends = sight_lines(rooms, 0.7, 3000)
+            counts = count_crossings(starts, ends,
+                                     segments_from_polygon(polygon))
+
+            expected = [shapely_walls(s, e, polygon)
+                        for s, e in zip(starts, ends)]
+            np.testing.assert_array_equal(counts, expected)
+
+    def test_tree_matches_brute_force(self):
+        for rooms in (sized_floor('small'), load_fixture('hall_and_wing')):
+            polygon, starts, ends = sight_lines(rooms, 0.7, 3000)
+            segments = segments_from_polygon(polygon)
+
+            np.testing.assert_array_equal(
+                count_crossings(starts, ends, segments,
+                                tree=wall_tree(segments)),
+                count_crossings(starts, ends, segments))
+
+    def test_line_along_wall(self):
+        polygon = shapely.box(0, 0, 4, 4)
+        segments = segments_from_polygon(polygon)
+
+        counts = count_crossings([[0, 1], [2, 2]], [[0, 4], [2, 4]], segments)
+        np.testing.assert_array_equal(counts, [0, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,4 +21,10 @@ from . import views
 urlpatterns = [
     path('api/map', views.send_room_map),
     path('api/solve', views.send_router_coverage_map),
+    path('api/data', views.send_coverage_data),
+    path('api/building', views.send_building_data),
+    path('api/jobs', views.submit_solve_job),
+    path('api/jobs/<str:job_id>', views.send_job_status),
+    path('api/jobs/<str:job_id>/result', views.send_job_result),
+    path('api/metrics', views.send_metrics),
 ]
@@ -1,45 +1,402 @@
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
-import matplotlib.pyplot as plt
-import io
-import time
+import asyncio
+import functools
+import threading
 
-from .app.map_gen import get_router_coverage_map_from_poids, get_room_map_from_poids
+from .app.map_gen import (get_room_map, fetch_rooms, fetch_building,
+                          hash_rooms, CANDIDATE_MODES)
+from .app.viz import figure_to_png
+from .app import compute
+from .app import metrics
+from .app.export import DTYPES, INT8
+from .app.optimization import COVER_MODES, EXACT
+from .app.cache import ResultCache, result_key
+from .app.compute import ComputePool, Overloaded
+from .app.jobs import JobQueue, DONE, FAILED
+from .app.session import SessionStore
 import urllib, base64
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type, Authorization'
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match',
+    'Access-Control-Expose-Headers': 'ETag, X-Cover-Method, X-Cover-Size, X-Cover-Gap, Server-Timing',
+    'Timing-Allow-Origin': '*',
 }
 
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+_compute_pool = None
+_compute_pool_lock = threading.Lock()
+
+def get_result_cache():
+    global _result_cache
+
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(settings.RESULT_CACHE_MAX_BYTES,
+                                        settings.RESULT_CACHE_DIR,
+                                        settings.RESULT_CACHE_MAX_DISK_BYTES)
+
+        return _result_cache
+
+def get_job_queue():
+    global _job_queue
+
+    with _job_queue_lock:
+        if _job_queue is None:
+            # Jobs count against the compute pool like requests do
+            _job_queue = JobQueue(settings.JOB_WORKERS,
+                                  settings.JOB_HISTORY,
+                                  get_compute_pool().admitted)
+
+        return _job_queue
+
+def get_session_store():
+    global _session_store
+
+    with _session_store_lock:
+        if _session_store is None:
+            _session_store = SessionStore(settings.SESSION_LIMIT)
+
+        return _session_store
+
+def get_compute_pool():
+    global _compute_pool
+
+    with _compute_pool_lock:
+        if _compute_pool is None:
+            _compute_pool = ComputePool(settings.COMPUTE_WORKERS,
+                                        settings.COMPUTE_QUEUE,
+                                        settings.COMPUTE_RETRY_AFTER)
+
+        return _compute_pool
+
+def in_thread(func):
+    return sync_to_async(func, thread_sensitive=False)
+
+def traced(endpoint):
+    """
+    Times the stages of a view, returns them in the Server-Timing header
+    and adds them to the metrics of endpoint. Invalid parameters raised as
+    BadRequest are answered with a 400.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                with metrics.tracing(endpoint) as trace:
+                    try:
+                        response = await view(request, *args, **kwargs)
+                    except BadRequest as e:
+                        response = bad_request_response(e)
+
+                response['Server-Timing'] = trace.server_timing()
+                return response
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                with metrics.tracing(endpoint) as trace:
+                    try:
+                        response = view(request, *args, **kwargs)
+                    except BadRequest as e:
+                        response = bad_request_response(e)
+
+                response['Server-Timing'] = trace.server_timing()
+                return response
+
+        return wrapper
+
+    return decorator
+
+def requested_rooms(request):
+    poids = [int(sid) for sid in request.GET.getlist('poid')]
+    with metrics.stage('fetch'):
+        return fetch_rooms(poids)
+
+async def fetch_requested_rooms(request):
+    poids = [int(sid) for sid in request.GET.getlist('poid')]
+    with metrics.stage('fetch'):
+        return await in_thread(fetch_rooms)(poids)
+
 def create_image_response_from_figure(fig):
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
+    return create_image_response(figure_to_png(fig))
 
-    res = HttpResponse(content=buf, content_type="image/png", status=200,
+def create_image_response(content, etag=None, headers=None):
+    return create_response(content, 'image/png', etag, headers)
+
+def create_response(content, content_type, etag=None, headers=None):
+    res = HttpResponse(content=content, content_type=content_type, status=200,
                        headers=CORS_HEADERS)
 
+    for name, value in (headers or {}).items():
+        res[name] = value
+
+    if etag is not None:
+        res['ETag'] = etag
+        # Let the browser keep the image but always revalidate it
+        res['Cache-Control'] = 'no-cache'
+
     return res
 
-def send_router_coverage_map(request):
-    poids_str = request.GET.getlist('poid')
-    poids = [int(sid) for sid in poids_str]
-    grid_resolution = float(request.GET.get('gres'))
-    max_path_loss = float(request.GET.get('maxloss'))
+def etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is None:
+        return False
+
+    tags = [t.strip() for t in if_none_match.split(',')]
+    tags = [t[2:] if t.startswith('W/') else t for t in tags]
+    return '*' in tags or etag in tags
+
+def not_modified_response(etag):
+    res = HttpResponseNotModified(headers=CORS_HEADERS)
+    res['ETag'] = etag
+    return res
+
+def bad_request_response(error):
+    return JsonResponse({'error': str(error)}, status=400,
+                        headers=CORS_HEADERS)
+
+def overloaded_response(retry_after):
+    res = JsonResponse({'error': 'Server is busy, try again later'},
+                       status=503, headers=CORS_HEADERS)
+    res['Retry-After'] = str(retry_after)
+    return res
+
+async def cached_response(request, key, compute_entry, content_type):
+    """
+    Responds with the content stored under key, computing and caching it
+    with await compute_entry() -> (content, headers) when it is missing
+    """
+    etag = f'"{key}"'
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+
+    cache = get_result_cache()
+    entry = await in_thread(cache.get)(key)
+    if entry is None:
+        try:
+            entry = await compute_entry()
+        except Overloaded as e:
+            return overloaded_response(e.retry_after)
+
+        await in_thread(cache.put)(key, *entry)
 
-    start_time = time.time()
-    fig = get_router_coverage_map_from_poids(poids, grid_resolution,
-                                             max_path_loss)
+    content, headers = entry
+    return create_response(content, content_type, etag, headers)
 
-    print(f'Time: {time.time() - start_time}')
-    return create_image_response_from_figure(fig)
+def optional_float(value):
+    return None if value is None else float(value)
 
-def send_room_map(request):
-    poids_str = request.GET.getlist('poid')
-    poids = [int(sid) for sid in poids_str]
+def choice(request, name, choices, default):
+    """
+    Returns the request parameter name, which has to be one of choices when
+    it is given
+    """
+    value = request.GET.get(name)
+    if value is None:
+        return default
+    if value not in choices:
+        raise BadRequest(f"Unknown {name} '{value}'")
+
+    return value
+
+def optional_positive_float(request, name):
+    value = optional_float(request.GET.get(name))
+    if value is not None and not value > 0:
+        raise BadRequest(f"{name} must be positive")
+
+    return value
+
+def solve_params(request):
+    return {
+        'gres': float(request.GET.get('gres')),
+        'maxloss': float(request.GET.get('maxloss')),
+        'mode': choice(request, 'mode', COVER_MODES, EXACT),
+        'timelimit': optional_float(request.GET.get('timelimit')),
+        'gap': optional_float(request.GET.get('gap')),
+        'session': request.GET.get('session'),
+        'coarse': int(request.GET.get('coarse', 1)),
+        'tile': optional_float(request.GET.get('tile')),
+        'candidates': choice(request, 'candidates', CANDIDATE_MODES, None),
+        'spacing': optional_positive_float(request, 'spacing'),
+    }
+
+def cover_headers(cover):
+    return {
+        'X-Cover-Method': cover.method,
+        'X-Cover-Size': str(cover.size),
+        'X-Cover-Gap': f'{cover.gap:.4f}',
+    }
+
+def request_session(params):
+    """
+    Returns the map session named in the request parameters, or None
+    """
+    if params['session'] is None:
+        return None
+
+    return get_session_store().get(params['session'], params['gres'],
+                                   params['maxloss'])
+
+async def run_solve(func, rooms, params):
+    """
+    Runs a solve in the compute pool. Map sessions live in this process, so
+    their solves run in a thread instead of a worker process.
+    """
+    pool = get_compute_pool()
+    session = request_session(params)
+    if session is None:
+        return await pool.run(func, rooms, params, settings.SOLVER_WORKERS)
+
+    return await pool.run_thread(func, rooms, params, settings.SOLVER_WORKERS,
+                                 session)
+
+def compute_router_coverage_map(rooms, params, progress=None):
+    """
+    Runs the solve pipeline of a job and returns the PNG and its response
+    headers. The job already holds a place in the compute pool. Map
+    sessions live in this process, so their solves run in the job thread.
+    """
+    session = request_session(params)
+    if session is None:
+        png, cover = get_compute_pool().call(compute.solve_image, rooms,
+                                             params, settings.SOLVER_WORKERS,
+                                             progress=progress)
+    else:
+        png, cover = compute.solve_image(rooms, params,
+                                         settings.SOLVER_WORKERS, session,
+                                         progress)
+
+    return png, cover_headers(cover)
+
+@traced('solve')
+async def send_router_coverage_map(request):
+    params = solve_params(request)
+    rooms = await fetch_requested_rooms(request)
+    key = result_key('solve', params, hash_rooms(rooms))
+
+    async def compute_entry():
+        png, cover = await run_solve(compute.solve_image, rooms, params)
+        return png, cover_headers(cover)
+
+    return await cached_response(request, key, compute_entry, 'image/png')
+
+@traced('data')
+async def send_coverage_data(request):
+    params = solve_params(request)
+    params['dtype'] = choice(request, 'dtype', DTYPES, INT8)
+    params['compress'] = request.GET.get('compress', '1') != '0'
+
+    rooms = await fetch_requested_rooms(request)
+    key = result_key('data', params, hash_rooms(rooms))
+
+    async def compute_entry():
+        data, cover = await run_solve(compute.solve_data, rooms, params)
+        return data, cover_headers(cover)
+
+    return await cached_response(request, key, compute_entry,
+                                 'application/json')
+
+@traced('building')
+async def send_building_data(request):
+    building_id = int(request.GET.get('building'))
+    params = solve_params(request)
+    params['building'] = building_id
+
+    with metrics.stage('fetch'):
+        floors = await in_thread(fetch_building)(building_id)
+    geometry_hash = hash_rooms([r for rooms in floors.values() for r in rooms])
+    key = result_key('building', params, geometry_hash)
+
+    async def compute_entry():
+        data = await get_compute_pool().run(compute.solve_building, floors,
+                                            params, settings.SOLVER_WORKERS)
+        return data, {}
+
+    return await cached_response(request, key, compute_entry,
+                                 'application/json')
+
+@csrf_exempt
+@require_POST
+@traced('jobs')
+def submit_solve_job(request):
+    params = solve_params(request)
+    rooms = requested_rooms(request)
+    key = result_key('solve', params, hash_rooms(rooms))
+
+    def run(progress):
+        cache = get_result_cache()
+        entry = cache.get(key)
+        if entry is None:
+            with metrics.tracing('job_run'):
+                entry = compute_router_coverage_map(rooms, params, progress)
+            cache.put(key, *entry)
+
+        return entry
+
+    try:
+        job = get_job_queue().submit(key, run)
+    except Overloaded as e:
+        return overloaded_response(e.retry_after)
+
+    return JsonResponse(job.to_dict(), status=202, headers=CORS_HEADERS)
+
+def send_job_status(request, job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return JsonResponse({'error': 'Unknown job'}, status=404,
+                            headers=CORS_HEADERS)
+
+    return JsonResponse(job.to_dict(), headers=CORS_HEADERS)
+
+def send_job_result(request, job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return JsonResponse({'error': 'Unknown job'}, status=404,
+                            headers=CORS_HEADERS)
+
+    if job.status == FAILED:
+        return JsonResponse(job.to_dict(), status=500, headers=CORS_HEADERS)
+
+    if job.status != DONE:
+        return JsonResponse(job.to_dict(), status=202, headers=CORS_HEADERS)
+
+    etag = f'"{job.key}"'
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+
+    content, headers = job.result
+    return create_image_response(content, etag, headers)
+
+@traced('map')
+async def send_room_map(request):
     grid_resolution = float(request.GET.get('gres'))
+    rooms = await fetch_requested_rooms(request)
+    key = result_key('map', {'gres': grid_resolution}, hash_rooms(rooms))
+
+    # Room maps are cheap, they are drawn in a thread outside the pool so
+    # they stay fast while solves are queued
+    def draw():
+        fig = get_room_map(rooms, grid_resolution)
+        return figure_to_png(fig), {}
+
+    return await cached_response(request, key, in_thread(draw), 'image/png')
 
-    fig = get_room_map_from_poids(poids, grid_resolution)
-    return create_image_response_from_figure(fig)
+def send_metrics(request):
+    data = metrics.registry.to_dict()
+    data['compute'] = {'pending': get_compute_pool().pending}
+    return JsonResponse(data, headers=CORS_HEADERS)
@@ -9,8 +9,16 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+if settings.WARM_UP:
+    # Load the views and run the solver once before taking traffic
+    import backend.urls
+    from backend.app.warmup import warm_up
+
+    warm_up()
@@ -0,0 +1,103 @@
+"""
+Synthetic floor plans for benchmarking, built from wings of offices on both
+sides of a corridor
+"""
+import json
+import os
+
+import numpy as np
+
+from backend.app.map_gen import (Coordinate, Room, parse_room,
+                                 points_to_coordinates)
+
+# Somewhere on the Gløshaugen campus
+ORIGIN = Coordinate(10.4035, 63.4155)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# Wings and offices per corridor side of the named sizes
+SIZES = {
+    'small': (1, 6),
+    'medium': (2, 12),
+    'large': (4, 20),
+}
+
+def rectangle(x0, y0, x1, y1):
+    return np.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)],
+                    dtype=np.float64)
+
+def synthetic_floor(wings=1, offices=8, office_width=4.0, office_depth=5.0,
+                    corridor_width=2.5, pillar_every=3, pillar_size=0.6,
+                    origin=ORIGIN):
+    """
+    Returns the rooms of a floor with the given number of wings stacked
+    north of each other. Every wing is a corridor with offices along both
+    sides, and every pillar_every-th office has a pillar as a hole.
+    """
+    rooms = []
+    wing_depth = 2 * office_depth + corridor_width
+    length = offices * office_width
+
+    for w in range(wings):
+        y0 = w * wing_depth
+        corridor_y0 = y0 + office_depth
+        corridor_y1 = corridor_y0 + corridor_width
+
+        rooms.append(_room(origin, rectangle(0, corridor_y0, length,
+                                             corridor_y1)))
+
+        for side_y0, side_y1 in ((y0, corridor_y0),
+                                 (corridor_y1, y0 + wing_depth)):
+            for i in range(offices):
+                x0 = i * office_width
+                outline = rectangle(x0, side_y0, x0 + office_width, side_y1)
+
+                holes = []
+                if pillar_every and i % pillar_every == pillar_every - 1:
+                    cx = x0 + office_width / 2
+                    cy = (side_y0 + side_y1) / 2
+                    h = pillar_size / 2
+                    holes.append(rectangle(cx - h, cy - h, cx + h, cy + h))
+
+                rooms.append(_room(origin, outline, holes))
+
+    return rooms
+
+def sized_floor(size):
+    wings, offices = SIZES[size]
+    return synthetic_floor(wings, offices)
+
+def room_to_json(room, poid, z=1):
+    """
+    Returns a room as a MazeMap POI, the format read by parse_room
+    """
+    center = room.coordinates[:-1].mean(axis=0)
+    return {
+        'poiId': poid,
+        'identifier': f'B{poid}',
+        'z': z,
+        'geometry': {
+            'type': 'Polygon',
+            'coordinates': [ring.tolist() for ring in room.rings()],
+        },
+        'point': {'type': 'Point', 'coordinates': center.tolist()},
+    }
+
+def load_fixture(name):
+    """
+    Returns the rooms in a fixture of MazeMap POIs
+    """
+    with open(os.path.join(FIXTURE_DIR, f'{name}.json')) as f:
+        return [parse_room(p) for p in json.load(f)['pois']]
+
+def fixture_names():
+    return sorted(n[:-5] for n in os.listdir(FIXTURE_DIR)
+                  if n.endswith('.json'))
+
+def _room(origin, outline, holes=()):
+    to_coordinates = lambda ring: points_to_coordinates(origin, ring)
+    coordinates = to_coordinates(outline)
+    center = coordinates[:-1].mean(axis=0)
+
+    return Room(Coordinate(center[0], center[1]), coordinates,
+                [to_coordinates(h) for h in holes])
@@ -0,0 +1,174 @@
+"""
+Times the stages of the router coverage pipeline on synthetic floors and
+fixtures, without any network access. Run from web/backend with
+
+    python -m benchmarks.run
+
+Every stage is timed over --repeat runs, keeping the fastest, and run once
+more under tracemalloc for its peak memory. With --baseline the results are
+compared to an earlier --output file, and the run fails if a stage got
+slower than the tolerance allows.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from backend.app import solver, viz
+from backend.app.map_gen import (CoveragePlan, RoomMap, grid_inside,
+                                 points_on_boundary, render_router_coverage)
+from backend.app.optimization import cover, COVER_MODES, GREEDY
+
+from .floorplans import SIZES, sized_floor, load_fixture, fixture_names
+
+STAGES = ('room_map', 'grid', 'solve', 'cover', 'intensity', 'render')
+
+def run_pipeline(rooms, grid_resolution, max_path_loss, cover_mode, workers,
+                 measure):
+    """
+    Runs the pipeline stage by stage. measure(stage, func) runs func and
+    returns its result.
+    """
+    room_map = measure('room_map', lambda: RoomMap(rooms))
+
+    bounds = room_map.bounds
+    grid_shape, grid_index, positions = measure(
+            'grid', lambda: grid_inside(room_map, grid_resolution))
+
+    covers, links = measure('solve', lambda: solver.solve(
+            positions, room_map.polygon, max_path_loss, workers,
+            lambda done, total: None, room_map.segments))
+
+    result = measure('cover', lambda: cover(covers, cover_mode))
+
+    all_positions = np.concatenate(
+            [positions, points_on_boundary(room_map.polygon, 4)])
+    intensities = measure('intensity', lambda: viz.intensity(
+            result.selection, all_positions, room_map.polygon, max_path_loss,
+            links, workers, room_map.segments))
+
+    plan = CoveragePlan(room_map, (bounds[0], bounds[1]), grid_shape,
+                        grid_resolution, grid_index, all_positions,
+                        len(positions), result, intensities)
+    measure('render', lambda: viz.figure_to_png(
+            render_router_coverage(plan)))
+
+    return len(positions), result.size
+
+def benchmark(rooms, grid_resolution, max_path_loss, cover_mode, workers,
+              repeat):
+    """
+    Returns the point count, router count, and the fastest time and peak
+    memory of every stage
+    """
+    times = {stage: float('inf') for stage in STAGES}
+    peaks = {}
+
+    def timed(stage, func):
+        start = time.perf_counter()
+        value = func()
+        times[stage] = min(times[stage], time.perf_counter() - start)
+        return value
+
+    def traced(stage, func):
+        tracemalloc.start()
+        try:
+            value = func()
+            peaks[stage] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return value
+
+    for _ in range(repeat):
+        point_count, router_count = run_pipeline(
+                rooms, grid_resolution, max_path_loss, cover_mode, workers,
+                timed)
+    run_pipeline(rooms, grid_resolution, max_path_loss, cover_mode, workers,
+                 traced)
+
+    return {
+        'points': point_count,
+        'routers': router_count,
+        'time': times,
+        'peak_bytes': peaks,
+    }
+
+def floors(names):
+    for name in names:
+        if name in SIZES:
+            yield name, sized_floor(name)
+        else:
+            yield name, load_fixture(name)
+
+def regressions(results, baseline, tolerance):
+    """
+    Returns a description of every stage that is more than tolerance slower
+    than in the baseline
+    """
+    found = []
+    for case, result in results.items():
+        previous = baseline.get(case)
+        if previous is None:
+            continue
+
+        for stage, seconds in result['time'].items():
+            before = previous['time'].get(stage)
+            if before is not None and seconds > before * (1 + tolerance):
+                found.append(f'{case} {stage}: {before:.3f}s -> '
+                             f'{seconds:.3f}s')
+
+    return found
+
+def print_result(case, result):
+    print(f"{case}: {result['points']} points, {result['routers']} routers")
+    for stage in STAGES:
+        print(f"  {stage:<10} {result['time'][stage] * 1000:10.1f} ms "
+              f"{result['peak_bytes'][stage] / 2**20:10.1f} MiB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--floors', nargs='+',
+                        default=['small', 'medium'] + fixture_names(),
+                        help='floor sizes (%s) or fixture names (%s)' % (
+                                ', '.join(SIZES), ', '.join(fixture_names())))
+    parser.add_argument('--resolutions', nargs='+', type=float,
+                        default=[1.0, 0.5])
+    parser.add_argument('--max-path-loss', type=float, default=75.0)
+    parser.add_argument('--mode', choices=COVER_MODES, default=GREEDY)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='compare to an earlier --output')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown against --baseline')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, rooms in floors(args.floors):
+        for grid_resolution in args.resolutions:
+            case = f'{name}@{grid_resolution:g}'
+            results[case] = benchmark(rooms, grid_resolution,
+                                      args.max_path_loss, args.mode,
+                                      args.workers, args.repeat)
+            print_result(case, results[case])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+
+        for line in found:
+            print(f'Regression: {line}')
+
+        return 1 if found else 0
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Measures how long a fresh backend process takes from its start until it has
+served its first /api/solve, with and without the warm-up hook. The rooms
+come from a fixture, so no network access is needed. Run from web/backend
+with
+
+    python -m benchmarks.startup
+
+Every run starts a new Python process, which loads the WSGI application like
+a server worker would and then sends a single request.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# A small solve, so the time is mostly spent starting up
+SOLVE_URL = '/api/solve?gres=1&maxloss=75&mode=greedy'
+
+class FixtureStore:
+    """
+    Geometry store serving the POIs of a fixture
+    """
+    def __init__(self, pois):
+        self.pois = {int(p['poiId']): p for p in pois}
+
+    def fetch_poi(self, poid):
+        return self.pois.get(int(poid))
+
+    def fetch_pois(self, poids):
+        return [self.fetch_poi(poid) for poid in poids]
+
+    def fetch_building_pois(self, building_id):
+        return list(self.pois.values())
+
+    def load_room_map(self, key):
+        return None
+
+    def save_room_map(self, key, data):
+        pass
+
+def child(fixture, warm_up):
+    """
+    Serves one /api/solve in this process and prints when the application
+    was ready and when the response was done
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    from django.conf import settings
+
+    django.setup()
+    settings.WARM_UP = warm_up
+    settings.ALLOWED_HOSTS = ['testserver']
+
+    from backend.app import map_gen
+    from .floorplans import FIXTURE_DIR
+
+    with open(os.path.join(FIXTURE_DIR, f'{fixture}.json')) as f:
+        pois = json.load(f)['pois']
+    map_gen.use_geometry_store(FixtureStore(pois))
+
+    from backend.wsgi import application
+    ready = time.time()
+
+    from django.test import Client
+    url = SOLVE_URL + ''.join(f"&poid={p['poiId']}" for p in pois)
+    response = Client().get(url)
+    assert response.status_code == 200, response.status_code
+
+    print(json.dumps({'ready': ready, 'served': time.time()}))
+
+def run(fixture, warm_up):
+    """
+    Returns the seconds from starting a process until its application was
+    ready and until its first response was served
+    """
+    command = [sys.executable, '-m', 'benchmarks.startup', '--child',
+               '--fixture', fixture]
+    if not warm_up:
+        command.append('--no-warm-up')
+
+    start = time.time()
+    output = subprocess.run(command, check=True, capture_output=True,
+                            text=True).stdout
+    stamps = json.loads(output.strip().splitlines()[-1])
+
+    return stamps['ready'] - start, stamps['served'] - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--fixture', default='hall_and_wing')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--no-warm-up', dest='warm_up', action='store_false',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.fixture, args.warm_up)
+        return 0
+
+    for warm_up in (False, True):
+        runs = [run(args.fixture, warm_up) for _ in range(args.repeat)]
+        ready = min(r for r, _ in runs)
+        served = min(s for _, s in runs)
+        print(f"{'with' if warm_up else 'without'} warm-up: "
+              f"ready {ready:.2f}s, first /api/solve {served:.2f}s, "
+              f"request {served - ready:.2f}s")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())